@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import functools
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+import context
+
+log = logging.getLogger("bot")
+
+loop = None
+loopThread = None
+loopLock = threading.Lock()
+
+
+def getLoop():
+	global loop
+	global loopThread
+	with loopLock:
+		if loop is None:
+			loop = asyncio.new_event_loop()
+			loop.set_default_executor(ThreadPoolExecutor(max_workers=globals.REDDIT_IO_THREADS, thread_name_prefix="redditio"))
+			loopThread = threading.Thread(target=loop.run_forever, name="aio", daemon=True)
+			loopThread.start()
+			log.debug("Started async io loop")
+	return loop
+
+
+async def call(function, *args):
+	return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+def wrap(function):
+	def wrapped(*args):
+		return call(context.capture().run, function, *args)
+	wrapped.__name__ = function.__name__ + "Async"
+	return wrapped
+
+
+def submit(coroutine):
+	return asyncio.run_coroutine_threadsafe(coroutine, getLoop())
+
+
+def run(coroutine):
+	return submit(coroutine).result()
+
+
+def gather(*coroutines):
+	async def gatherAll():
+		return await asyncio.gather(*coroutines)
+	return run(gatherAll())
@@ -0,0 +1,222 @@
+import os
+import json
+import lzma
+import pickle
+import logging.handlers
+from datetime import datetime
+
+import globals
+
+log = logging.getLogger("bot")
+
+MANIFEST_NAME = "manifest.json"
+SEGMENT_PREFIX = "segment"
+SEGMENT_EXTENSION = ".xz"
+
+manifest = None
+
+
+def manifestPath():
+	return os.path.join(globals.ARCHIVE_FOLDER_NAME, MANIFEST_NAME)
+
+
+def stagedPath(thread):
+	return os.path.join(globals.ARCHIVE_FOLDER_NAME, thread)
+
+
+def segmentPath(segment):
+	return os.path.join(globals.ARCHIVE_FOLDER_NAME, segment)
+
+
+def isArchiveFile(fileName):
+	return fileName == MANIFEST_NAME or fileName.startswith(SEGMENT_PREFIX) or fileName.endswith(".tmp")
+
+
+def loadManifest():
+	global manifest
+	if manifest is not None:
+		return manifest
+	try:
+		file = open(manifestPath(), 'r')
+	except FileNotFoundError:
+		manifest = {'segments': 0, 'games': {}}
+		return manifest
+	manifest = json.load(file)
+	file.close()
+	return manifest
+
+
+def saveManifest():
+	tempName = manifestPath() + ".tmp"
+	file = open(tempName, 'w')
+	json.dump(manifest, file)
+	file.close()
+	os.replace(tempName, manifestPath())
+
+
+def buildEntry(game, archived):
+	return {
+		'home': game.home.tag,
+		'away': game.away.tag,
+		'homeName': game.home.name,
+		'awayName': game.away.name,
+		'winner': game.status.winner,
+		'season': archived.year,
+		'date': archived.strftime("%Y-%m-%d %H:%M:%S"),
+		'segment': None
+	}
+
+
+def archiveGame(thread):
+	gamePath = "{}/{}".format(globals.SAVE_FOLDER_NAME, thread)
+	file = open(gamePath, 'rb')
+	game = pickle.load(file)
+	file.close()
+
+	saveGame(game)
+	os.remove(gamePath)
+
+
+def saveGame(game):
+	loadManifest()
+	tempName = stagedPath(game.thread) + ".tmp"
+	file = open(tempName, 'wb')
+	pickle.dump(game, file)
+	file.close()
+	os.replace(tempName, stagedPath(game.thread))
+
+	entry = buildEntry(game, datetime.utcnow())
+	if game.thread in manifest['games']:
+		entry['season'] = manifest['games'][game.thread]['season']
+		entry['date'] = manifest['games'][game.thread]['date']
+	manifest['games'][game.thread] = entry
+	saveManifest()
+	log.debug("Staged game {} in archive".format(game.thread))
+
+	if len(getStagedThreads()) >= globals.ARCHIVE_SEGMENT_SIZE:
+		compactSegment()
+
+
+def removeGame(thread):
+	loadManifest()
+	if thread not in manifest['games']:
+		return False
+	if manifest['games'][thread]['segment'] is None:
+		os.remove(stagedPath(thread))
+	del manifest['games'][thread]
+	saveManifest()
+	log.debug("Removed game {} from archive".format(thread))
+	return True
+
+
+def getStagedThreads():
+	loadManifest()
+	return [thread for thread, entry in manifest['games'].items() if entry['segment'] is None]
+
+
+def compactSegment():
+	loadManifest()
+	threads = getStagedThreads()[:globals.ARCHIVE_SEGMENT_SIZE]
+	if not len(threads):
+		return None
+
+	segment = "{}{:05d}{}".format(SEGMENT_PREFIX, manifest['segments'], SEGMENT_EXTENSION)
+	gameBytes = {}
+	for thread in threads:
+		file = open(stagedPath(thread), 'rb')
+		gameBytes[thread] = file.read()
+		file.close()
+
+	tempName = segmentPath(segment) + ".tmp"
+	file = open(tempName, 'wb')
+	file.write(lzma.compress(pickle.dumps(gameBytes)))
+	file.close()
+	os.replace(tempName, segmentPath(segment))
+
+	for thread in threads:
+		manifest['games'][thread]['segment'] = segment
+	manifest['segments'] += 1
+	saveManifest()
+
+	for thread in threads:
+		os.remove(stagedPath(thread))
+
+	log.info("Compacted {} games into archive segment {}".format(len(threads), segment))
+	return segment
+
+
+def loadSegment(segment):
+	file = open(segmentPath(segment), 'rb')
+	gameBytes = pickle.loads(lzma.decompress(file.read()))
+	file.close()
+	return gameBytes
+
+
+def getGame(thread):
+	loadManifest()
+	if thread not in manifest['games']:
+		return None
+	segment = manifest['games'][thread]['segment']
+	if segment is None:
+		file = open(stagedPath(thread), 'rb')
+		game = pickle.load(file)
+		file.close()
+		return game
+	else:
+		return pickle.loads(loadSegment(segment)[thread])
+
+
+def findGames(team=None, season=None, start=None, end=None):
+	loadManifest()
+	if team is not None:
+		team = team.lower()
+	results = []
+	for thread, entry in manifest['games'].items():
+		if team is not None and team != entry['home'] and team != entry['away']:
+			continue
+		if season is not None and season != entry['season']:
+			continue
+		date = datetime.strptime(entry['date'], "%Y-%m-%d %H:%M:%S")
+		if start is not None and date < start:
+			continue
+		if end is not None and date > end:
+			continue
+		results.append(thread)
+	return results
+
+
+def iterateGames(threads=None):
+	loadManifest()
+	if threads is None:
+		threads = list(manifest['games'].keys())
+
+	bySegment = {}
+	for thread in threads:
+		if thread in manifest['games']:
+			bySegment.setdefault(manifest['games'][thread]['segment'], []).append(thread)
+
+	for segment, segmentThreads in bySegment.items():
+		if segment is None:
+			for thread in segmentThreads:
+				yield getGame(thread)
+		else:
+			gameBytes = loadSegment(segment)
+			for thread in segmentThreads:
+				yield pickle.loads(gameBytes[thread])
+
+
+def indexLooseFiles():
+	loadManifest()
+	count = 0
+	for fileName in os.listdir(globals.ARCHIVE_FOLDER_NAME):
+		if isArchiveFile(fileName) or fileName in manifest['games']:
+			continue
+		file = open(stagedPath(fileName), 'rb')
+		game = pickle.load(file)
+		file.close()
+		archived = datetime.utcfromtimestamp(os.path.getmtime(stagedPath(fileName)))
+		manifest['games'][fileName] = buildEntry(game, archived)
+		count += 1
+	saveManifest()
+	log.info("Indexed {} loose archive files".format(count))
+	return count
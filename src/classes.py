@@ -265,6 +265,11 @@ class Game:
 		self.deadline = datetime.utcnow() + timedelta(days=10)
 		self.forceChew = False
 		self.playclockWarning = False
+		self.version = 0
+		self.forecastTime = None
+		self.forecastClock = None
+		self.secondsPerClock = None
+		self.projectedFinish = None
 
 	def team(self, isHome):
 		if isHome:
@@ -276,6 +281,43 @@ class Game:
 		return self.__dict__
 
 
+class GameHeader:
+	formatVersion = 2
+
+	def __init__(self, game):
+		self.format = GameHeader.formatVersion
+		self.thread = game.thread
+		self.homeTag = game.home.tag
+		self.awayTag = game.away.tag
+		self.homeName = game.home.name
+		self.awayName = game.away.name
+		self.homeCoaches = list(game.home.coaches)
+		self.awayCoaches = list(game.away.coaches)
+		self.playclock = game.playclock
+		self.deadline = game.deadline
+		self.errored = game.errored
+		self.playclockWarning = game.playclockWarning
+		self.quarter = game.status.quarter
+		self.clock = game.status.clock
+		self.version = getattr(game, 'version', 0)
+		self.waitingOnTag = game.team(game.status.waitingOn).tag
+		self.remainingClock = getattr(game, 'forecastClock', None)
+		self.secondsPerClock = getattr(game, 'secondsPerClock', None)
+		self.projectedFinish = getattr(game, 'projectedFinish', None)
+
+	def coaches(self, isHome):
+		if isHome:
+			return self.homeCoaches
+		else:
+			return self.awayCoaches
+
+	def tag(self, isHome):
+		if isHome:
+			return self.homeTag
+		else:
+			return self.awayTag
+
+
 movementPlays = [Play.RUN, Play.PASS]
 normalPlays = [Play.RUN, Play.PASS, Play.PUNT, Play.FIELD_GOAL]
 timePlays = [Play.KNEEL, Play.SPIKE]
@@ -0,0 +1,14 @@
+import contextvars
+
+game = contextvars.ContextVar('game', default=None)
+logGameId = contextvars.ContextVar('logGameId', default="")
+startTime = contextvars.ContextVar('startTime', default=None)
+journalEntry = contextvars.ContextVar('journalEntry', default=None)
+
+
+def runFresh(function, *args):
+	return contextvars.Context().run(function, *args)
+
+
+def capture():
+	return contextvars.copy_context()
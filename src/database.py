@@ -1,16 +1,82 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 import globals
 
 dbConn = None
+lock = threading.RLock()
+local = threading.local()
+
+SELECT_PAST_PLAYCLOCK = '''
+	SELECT ThreadID
+	FROM games
+	WHERE Complete = 0
+		and Errored = 0
+		and Playclock < ?
+	ORDER BY Playclock
+'''
+
+SELECT_PAST_WARNING = '''
+	SELECT ThreadID
+	FROM games
+	WHERE Complete = 0
+		and Errored = 0
+		and PlayclockWarning < ?
+	ORDER BY PlayclockWarning
+'''
+
+UPSERT_SCHEDULE = '''
+	INSERT INTO games
+	(ThreadID, Playclock, Deadline, PlayclockWarning, Errored, Complete)
+	VALUES (?, ?, ?, ?, ?, 0)
+	ON CONFLICT (ThreadID) DO UPDATE
+	SET Playclock = excluded.Playclock
+		,Deadline = excluded.Deadline
+		,PlayclockWarning = excluded.PlayclockWarning
+		,Errored = excluded.Errored
+		,Complete = 0
+'''
+
+COMPLETE_GAME = '''
+	UPDATE games
+	SET Complete = 1
+		,PlayclockWarning = NULL
+	WHERE ThreadID = ?
+'''
+
+UPSERT_THING = '''
+	INSERT INTO things
+	(Fullname, ThreadID, DataTable)
+	VALUES (?, ?, ?)
+	ON CONFLICT (Fullname) DO UPDATE
+	SET ThreadID = excluded.ThreadID
+		,DataTable = excluded.DataTable
+'''
+
+SELECT_THING = '''
+	SELECT DataTable
+	FROM things
+	WHERE Fullname = ?
+'''
+
+DELETE_THINGS = '''
+	DELETE FROM things
+	WHERE ThreadID = ?
+'''
+
+SELECT_ACTIVE_THREADS = '''
+	SELECT ThreadID
+	FROM games
+	WHERE Complete = 0
+'''
 
 
 def init():
 	global dbConn
-	dbConn = sqlite3.connect(globals.DATABASE_NAME)
+	dbConn = sqlite3.connect(globals.DATABASE_NAME, cached_statements=256, check_same_thread=False)
 
-	dbConn = sqlite3.connect(globals.DATABASE_NAME)
 	c = dbConn.cursor()
 	c.execute('''
 		CREATE TABLE IF NOT EXISTS games (
@@ -18,6 +84,7 @@ def init():
 			ThreadID VARCHAR(80) NOT NULL,
 			Deadline TIMESTAMP NOT NULL DEFAULT (DATETIME(CURRENT_TIMESTAMP, '+10 days')),
 			Playclock TIMESTAMP NOT NULL DEFAULT (DATETIME(CURRENT_TIMESTAMP, '+24 hours')),
+			PlayclockWarning TIMESTAMP NULL DEFAULT (DATETIME(CURRENT_TIMESTAMP, '+12 hours')),
 			Complete BOOLEAN NOT NULL DEFAULT 0,
 			Errored BOOLEAN NOT NULL DEFAULT 0,
 			UNIQUE (ThreadID)
@@ -33,217 +100,356 @@ def init():
 			FOREIGN KEY(GameID) REFERENCES games(ID)
 		)
 	''')
+
+	c.execute('''
+		CREATE TABLE IF NOT EXISTS things (
+			Fullname VARCHAR(80) NOT NULL PRIMARY KEY,
+			ThreadID VARCHAR(80) NOT NULL,
+			DataTable TEXT NOT NULL,
+			Created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+		)
+	''')
+	c.execute('''
+		CREATE INDEX IF NOT EXISTS things_thread
+		ON things (ThreadID)
+	''')
+
+	columns = [row[1] for row in c.execute("PRAGMA table_info(games)")]
+	if 'PlayclockWarning' not in columns:
+		c.execute('''
+			ALTER TABLE games
+			ADD COLUMN PlayclockWarning TIMESTAMP NULL
+		''')
+		c.execute('''
+			UPDATE games
+			SET PlayclockWarning = DATETIME(Playclock, '-12 hours')
+		''')
+
+	c.execute('''
+		CREATE INDEX IF NOT EXISTS games_playclock
+		ON games (Complete, Errored, Playclock)
+	''')
+	c.execute('''
+		CREATE INDEX IF NOT EXISTS games_warning
+		ON games (Complete, Errored, PlayclockWarning)
+	''')
 	dbConn.commit()
 
 
 def close():
-	dbConn.commit()
-	dbConn.close()
+	with lock:
+		dbConn.commit()
+		dbConn.close()
+
+
+def getBatchDepth():
+	return getattr(local, 'batchDepth', 0)
+
+
+@contextmanager
+def transaction():
+	with lock:
+		local.batchDepth = getBatchDepth() + 1
+		try:
+			yield
+		except Exception:
+			local.batchDepth -= 1
+			if local.batchDepth == 0:
+				dbConn.rollback()
+			raise
+		local.batchDepth -= 1
+		commit()
+
+
+def commit():
+	with lock:
+		if getBatchDepth() == 0:
+			dbConn.commit()
+
+
+def formatTimestamp(dtTm):
+	if dtTm is None:
+		return None
+	return dtTm.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parseTimestamp(timestamp):
+	if timestamp is None:
+		return None
+	return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
 
 
 def createNewGame(thread):
-	c = dbConn.cursor()
-	try:
-		c.execute('''
-			INSERT INTO games
-			(ThreadID)
-			VALUES (?)
-		''', (thread,))
-	except sqlite3.IntegrityError:
-		return False
+	with lock:
+		c = dbConn.cursor()
+		try:
+			c.execute('''
+				INSERT INTO games
+				(ThreadID)
+				VALUES (?)
+			''', (thread,))
+		except sqlite3.IntegrityError:
+			return False
 
-	dbConn.commit()
+		commit()
 
-	return c.lastrowid
+		return c.lastrowid
 
 
 def addCoach(gameId, coach, home):
-	c = dbConn.cursor()
-	try:
-		c.execute('''
-			INSERT INTO coaches
-			(GameID, Coach, HomeTeam)
-			VALUES (?, ?, ?)
-		''', (gameId, coach.lower(), home))
-	except sqlite3.IntegrityError:
-		return False
-
-	dbConn.commit()
-	return True
+	with lock:
+		c = dbConn.cursor()
+		try:
+			c.execute('''
+				INSERT INTO coaches
+				(GameID, Coach, HomeTeam)
+				VALUES (?, ?, ?)
+			''', (gameId, coach.lower(), home))
+		except sqlite3.IntegrityError:
+			return False
+
+		commit()
+		return True
 
 
 def getGameByCoach(coach):
-	c = dbConn.cursor()
-	result = c.execute('''
-		SELECT g.ID
-			,g.ThreadID
-			,g.Errored
-			,group_concat(c2.Coach) as Coaches
-		FROM games g
-			INNER JOIN coaches c
-				ON g.ID = c.GameID
-			LEFT JOIN coaches c2
-				on g.ID = c2.GameID
-		WHERE c.Coach = ?
-			and g.Complete = 0
-		GROUP BY g.ID, g.ThreadID
-	''', (coach.lower(),))
-
-	resultTuple = result.fetchone()
-
-	if not resultTuple:
-		return None
-	else:
-		return {'id': resultTuple[0], 'thread': resultTuple[1], 'errored': resultTuple[2] == 1,
-		        'coaches': resultTuple[3].split(',')}
+	with lock:
+		c = dbConn.cursor()
+		result = c.execute('''
+			SELECT g.ID
+				,g.ThreadID
+				,g.Errored
+				,group_concat(c2.Coach) as Coaches
+			FROM games g
+				INNER JOIN coaches c
+					ON g.ID = c.GameID
+				LEFT JOIN coaches c2
+					on g.ID = c2.GameID
+			WHERE c.Coach = ?
+				and g.Complete = 0
+			GROUP BY g.ID, g.ThreadID
+		''', (coach.lower(),))
+
+		resultTuple = result.fetchone()
+
+		if not resultTuple:
+			return None
+		else:
+			return {'id': resultTuple[0], 'thread': resultTuple[1], 'errored': resultTuple[2] == 1,
+			        'coaches': resultTuple[3].split(',')}
 
 
 def getGameByID(id):
-	c = dbConn.cursor()
-	result = c.execute('''
-		SELECT g.ThreadID
-			,g.Errored
-			,group_concat(c.Coach) as Coaches
-		FROM games g
-			LEFT JOIN coaches c
-				ON g.ID = c.GameID
-		WHERE g.ID = ?
-			and g.Complete = 0
-		GROUP BY g.ThreadID
-	''', (id,))
-
-	resultTuple = result.fetchone()
-
-	if not resultTuple:
-		return None
-	else:
-		return {'id': id, 'thread': resultTuple[0], 'errored': resultTuple[1] == 1,
-		        'coaches': resultTuple[3].split(',')}
+	with lock:
+		c = dbConn.cursor()
+		result = c.execute('''
+			SELECT g.ThreadID
+				,g.Errored
+				,group_concat(c.Coach) as Coaches
+			FROM games g
+				LEFT JOIN coaches c
+					ON g.ID = c.GameID
+			WHERE g.ID = ?
+				and g.Complete = 0
+			GROUP BY g.ThreadID
+		''', (id,))
+
+		resultTuple = result.fetchone()
+
+		if not resultTuple:
+			return None
+		else:
+			return {'id': id, 'thread': resultTuple[0], 'errored': resultTuple[1] == 1,
+			        'coaches': resultTuple[2].split(',')}
 
 
 def endGame(threadId):
-	c = dbConn.cursor()
-	c.execute('''
-		UPDATE games
-		SET Complete = 1
-			,Playclock = CURRENT_TIMESTAMP
-		WHERE ThreadID = ?
-	''', (threadId,))
-	dbConn.commit()
+	with lock:
+		c = dbConn.cursor()
+		c.execute('''
+			UPDATE games
+			SET Complete = 1
+				,Playclock = CURRENT_TIMESTAMP
+			WHERE ThreadID = ?
+		''', (threadId,))
+		commit()
 
-	if c.rowcount == 1:
-		return True
-	else:
-		return False
+		if c.rowcount == 1:
+			return True
+		else:
+			return False
 
 
 def unEndGame(threadId):
-	c = dbConn.cursor()
-	c.execute('''
-		UPDATE games
-		SET Complete = 0
-			,Playclock = DATETIME(CURRENT_TIMESTAMP, '+24 hours')
-		WHERE ThreadID = ?
-	''', (threadId,))
-	dbConn.commit()
+	with lock:
+		c = dbConn.cursor()
+		c.execute('''
+			UPDATE games
+			SET Complete = 0
+				,Playclock = DATETIME(CURRENT_TIMESTAMP, '+24 hours')
+			WHERE ThreadID = ?
+		''', (threadId,))
+		commit()
 
-	if c.rowcount == 1:
-		return True
-	else:
-		return False
+		if c.rowcount == 1:
+			return True
+		else:
+			return False
 
 
 def pauseGame(threadID, hours):
-	c = dbConn.cursor()
-	c.execute('''
-		UPDATE games
-		SET Playclock = DATETIME(CURRENT_TIMESTAMP, '+' || ? || ' hours')
-			,Deadline = DATETIME(Deadline, '+' || ? || ' hours')
-		WHERE ThreadID = ?
-	''', (str(hours), str(hours), threadID))
-	dbConn.commit()
+	with lock:
+		c = dbConn.cursor()
+		c.execute('''
+			UPDATE games
+			SET Playclock = DATETIME(CURRENT_TIMESTAMP, '+' || ? || ' hours')
+				,Deadline = DATETIME(Deadline, '+' || ? || ' hours')
+			WHERE ThreadID = ?
+		''', (str(hours), str(hours), threadID))
+		commit()
 
 
 def setGamePlayed(gameID):
-	c = dbConn.cursor()
-	c.execute('''
-		UPDATE games
-		SET Playclock = DATETIME(CURRENT_TIMESTAMP, '+24 hours')
-		WHERE ID = ?
-	''', (gameID,))
-	dbConn.commit()
+	with lock:
+		c = dbConn.cursor()
+		c.execute('''
+			UPDATE games
+			SET Playclock = DATETIME(CURRENT_TIMESTAMP, '+24 hours')
+			WHERE ID = ?
+		''', (gameID,))
+		commit()
 
 
 def getGamePlayed(gameID):
-	c = dbConn.cursor()
-	result = c.execute('''
-		SELECT Playclock
-		FROM games
-		WHERE ID = ?
-	''', (gameID,))
+	with lock:
+		c = dbConn.cursor()
+		result = c.execute('''
+			SELECT Playclock
+			FROM games
+			WHERE ID = ?
+		''', (gameID,))
 
-	resultTuple = result.fetchone()
+		resultTuple = result.fetchone()
 
-	if not resultTuple:
-		return None
+		if not resultTuple:
+			return None
 
-	return datetime.strptime(resultTuple[0], "%Y-%m-%d %H:%M:%S")
+		return parseTimestamp(resultTuple[0])
 
 
 def getGameDeadline(gameID):
-	c = dbConn.cursor()
-	result = c.execute('''
-		SELECT Deadline
-		FROM games
-		WHERE ID = ?
-	''', (gameID,))
+	with lock:
+		c = dbConn.cursor()
+		result = c.execute('''
+			SELECT Deadline
+			FROM games
+			WHERE ID = ?
+		''', (gameID,))
 
-	resultTuple = result.fetchone()
+		resultTuple = result.fetchone()
 
-	if not resultTuple:
-		return None
+		if not resultTuple:
+			return None
 
-	return datetime.strptime(resultTuple[0], "%Y-%m-%d %H:%M:%S")
+		return parseTimestamp(resultTuple[0])
 
 
-def getGamesPastPlayclock():
-	c = dbConn.cursor()
-	results = []
-	for row in c.execute('''
-		SELECT ThreadID
-		FROM games
-		WHERE Playclock < CURRENT_TIMESTAMP
-			and Complete = 0
-			and Errored = 0
-		'''):
-		results.append(row[0])
+def getGamesPastPlayclock(now=None):
+	with lock:
+		c = dbConn.cursor()
+		results = []
+		for row in c.execute(SELECT_PAST_PLAYCLOCK, (formatTimestamp(now if now is not None else datetime.utcnow()),)):
+			results.append(row[0])
 
-	return results
+		return results
 
 
-def clearGameErrored(threadID):
-	try:
+def getGamesPastPlayclockWarning(now=None):
+	with lock:
 		c = dbConn.cursor()
-		c.execute('''
-			UPDATE games
-			SET Errored = 0
-				,Deadline = DATETIME(Deadline, '+' || ((julianday(CURRENT_TIMESTAMP) - julianday(Playclock)) * 86400.0) || ' seconds')
-				,Playclock = DATETIME(CURRENT_TIMESTAMP, '+24 hours')
-			WHERE ThreadID = ?
-				AND Errored = 1
-		''', (threadID,))
-		dbConn.commit()
-	except Exception as err:
-		return False
-	return True
+		results = []
+		for row in c.execute(SELECT_PAST_WARNING, (formatTimestamp(now if now is not None else datetime.utcnow()),)):
+			results.append(row[0])
+
+		return results
+
+
+def updateGameSchedule(threadID, playclock, deadline, warning, errored):
+	with lock:
+		c = dbConn.cursor()
+		c.execute(UPSERT_SCHEDULE, (
+			threadID,
+			formatTimestamp(playclock),
+			formatTimestamp(deadline),
+			formatTimestamp(warning),
+			errored
+		))
+		commit()
+
+
+def completeGame(threadID):
+	with lock:
+		c = dbConn.cursor()
+		c.execute(COMPLETE_GAME, (threadID,))
+		completed = c.rowcount == 1
+		c.execute(DELETE_THINGS, (threadID,))
+		commit()
+
+		return completed
+
+
+def addThing(fullname, threadID, dataTable):
+	with lock:
+		c = dbConn.cursor()
+		c.execute(UPSERT_THING, (fullname, threadID, dataTable))
+		commit()
+
+
+def getThing(fullname):
+	with lock:
+		c = dbConn.cursor()
+		resultTuple = c.execute(SELECT_THING, (fullname,)).fetchone()
+
+		if not resultTuple:
+			return None
+		return resultTuple[0]
+
+
+def getActiveThreads():
+	with lock:
+		c = dbConn.cursor()
+		results = []
+		for row in c.execute(SELECT_ACTIVE_THREADS):
+			results.append(row[0])
+
+		return results
+
+
+def clearGameErrored(threadID):
+	with lock:
+		try:
+			c = dbConn.cursor()
+			c.execute('''
+				UPDATE games
+				SET Errored = 0
+					,Deadline = DATETIME(Deadline, '+' || ((julianday(CURRENT_TIMESTAMP) - julianday(Playclock)) * 86400.0) || ' seconds')
+					,Playclock = DATETIME(CURRENT_TIMESTAMP, '+24 hours')
+				WHERE ThreadID = ?
+					AND Errored = 1
+			''', (threadID,))
+			commit()
+		except Exception as err:
+			return False
+		return True
 
 
 def setGameErrored(gameID):
-	c = dbConn.cursor()
-	c.execute('''
-		UPDATE games
-		SET Errored = 1
-			,Playclock = CURRENT_TIMESTAMP
-		WHERE ID = ?
-	''', (gameID,))
-	dbConn.commit()
+	with lock:
+		c = dbConn.cursor()
+		c.execute('''
+			UPDATE games
+			SET Errored = 1
+				,Playclock = CURRENT_TIMESTAMP
+			WHERE ID = ?
+		''', (gameID,))
+		commit()
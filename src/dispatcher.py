@@ -0,0 +1,207 @@
+import time
+import threading
+import traceback
+import logging.handlers
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+import wiki
+import utils
+import index
+import reddit
+import journal
+import messages
+import scheduler
+import ratelimit
+import context
+
+log = logging.getLogger("bot")
+
+condition = threading.Condition()
+sharedCount = 0
+exclusiveOwner = None
+exclusiveDepth = 0
+exclusiveWaiting = 0
+
+queueLock = threading.Lock()
+queues = {}
+active = set()
+executor = None
+
+
+@contextmanager
+def shared():
+	global sharedCount
+	if exclusiveOwner == threading.get_ident():
+		yield
+		return
+	with condition:
+		while exclusiveOwner is not None or exclusiveWaiting > 0:
+			condition.wait()
+		sharedCount += 1
+	try:
+		yield
+	finally:
+		with condition:
+			sharedCount -= 1
+			condition.notify_all()
+
+
+@contextmanager
+def exclusive():
+	global exclusiveOwner
+	global exclusiveDepth
+	global exclusiveWaiting
+	with condition:
+		if exclusiveOwner != threading.get_ident():
+			exclusiveWaiting += 1
+			while exclusiveOwner is not None or sharedCount > 0:
+				condition.wait()
+			exclusiveWaiting -= 1
+			exclusiveOwner = threading.get_ident()
+		exclusiveDepth += 1
+	try:
+		yield
+	finally:
+		with condition:
+			exclusiveDepth -= 1
+			if exclusiveDepth == 0:
+				exclusiveOwner = None
+				condition.notify_all()
+
+
+def getExecutor():
+	global executor
+	if executor is None:
+		executor = ThreadPoolExecutor(max_workers=globals.DISPATCH_THREADS, thread_name_prefix="dispatch")
+	return executor
+
+
+def getRoute(message):
+	if message.parent_id is None:
+		return None
+	dataTable = utils.getThingTable(message.parent_id)
+	if dataTable is not None and dataTable['thread'] in index.headers:
+		return dataTable['thread']
+	return None
+
+
+def dispatch(message):
+	key = getRoute(message)
+	log.debug("Routing message {} to {}".format(message.id, key if key is not None else "exclusive"))
+	enqueue(key, process, message, key)
+
+
+def dispatchTask(thread, function, *args):
+	key = thread if thread in index.headers else None
+	enqueue(key, runTask, key, function, *args)
+
+
+def enqueue(key, function, *args):
+	with queueLock:
+		queues.setdefault(key, deque()).append((function, args))
+		if key in active:
+			return
+		active.add(key)
+	getExecutor().submit(drain, key)
+
+
+def drain(key):
+	while True:
+		with queueLock:
+			if not len(queues[key]):
+				del queues[key]
+				active.discard(key)
+				return
+			function, args = queues[key].popleft()
+
+		try:
+			context.runFresh(function, *args)
+		except Exception as err:
+			log.warning("Error in dispatcher")
+			log.warning(traceback.format_exc())
+
+
+def process(message, key):
+	context.startTime.set(time.perf_counter())
+	with (exclusive() if key is None else shared()):
+		log.debug("Processing message")
+		try:
+			messages.processMessage(message)
+		except Exception as err:
+			log.warning("Error processing message")
+			log.warning(traceback.format_exc())
+			game = context.game.get()
+			if game is None and key is not None:
+				game = index.getGame(key)
+			if game is not None:
+				log.debug("Setting game {} as errored".format(game.thread))
+				index.setGameErrored(game)
+				utils.saveGameObject(game)
+				ownerMessage = utils.renderGameStatusMessage(game)
+
+				reddit.replyMessage(message, "This game has errored. Please wait for the bot owner to help.")
+			else:
+				ownerMessage = "Unable to process message from /u/{}, skipping".format(str(message.author))
+
+			journal.commit()
+
+			try:
+				reddit.sendMessage(globals.OWNER, "NCFAA game errored", ownerMessage, ratelimit.BULK)
+				reddit.markRead(message)
+			except Exception as err2:
+				log.warning("Error sending error message")
+				log.warning(traceback.format_exc())
+
+		log.debug("Message processed after: %d", int(time.perf_counter() - context.startTime.get()))
+		utils.clearLogGameID()
+	scheduler.wake()
+
+
+def runTask(key, function, *args):
+	with (exclusive() if key is None else shared()):
+		try:
+			function(*args)
+		except Exception as err:
+			log.warning("Error running task for {}".format(key if key is not None else "exclusive"))
+			log.warning(traceback.format_exc())
+
+
+def catchUp():
+	startTime = time.perf_counter()
+	seen = set()
+	total = 0
+	while True:
+		backlog = [message for message in reddit.getMessages() if message.fullname not in seen]
+		if not len(backlog):
+			break
+		backlog.sort(key=lambda message: message.created_utc)
+		seen.update([message.fullname for message in backlog])
+		log.info("Catching up on {} unread messages".format(len(backlog)))
+
+		refreshPages()
+		with reddit.thingBatch(), reddit.deferMarkRead(journal.releaseRead):
+			messages.prefetchParents(backlog)
+			for message in backlog:
+				dispatch(message)
+			waitIdle()
+		total += len(backlog)
+
+	if total > 0:
+		log.info("Caught up on {} messages in {:.1f} seconds".format(total, time.perf_counter() - startTime))
+
+
+def refreshPages():
+	if wiki.pagesStale():
+		with exclusive():
+			wiki.loadPages()
+
+
+def waitIdle():
+	while True:
+		with queueLock:
+			if not len(active):
+				return
+		time.sleep(0.1)
@@ -0,0 +1,137 @@
+import os
+import pickle
+import hashlib
+import threading
+import logging.handlers
+from datetime import datetime
+from datetime import timedelta
+
+import globals
+import utils
+import index
+import reddit
+import outbound
+import dispatcher
+import scheduler
+from classes import Action
+
+log = logging.getLogger("bot")
+
+lock = threading.Lock()
+pending = {}
+unsent = {}
+lastHashes = {}
+
+
+def init():
+	try:
+		file = open(globals.EDITS_FILE_NAME, 'rb')
+	except FileNotFoundError:
+		return
+	threads = pickle.load(file)
+	file.close()
+	with lock:
+		for thread in threads:
+			unsent[thread] = threads[thread]
+			pending[thread] = datetime.utcnow()
+	log.info("Queued {} thread edits left over from last run".format(len(threads)))
+
+
+def saveUnsent():
+	tempName = globals.EDITS_FILE_NAME + ".tmp"
+	file = open(tempName, 'wb')
+	pickle.dump(unsent, file)
+	file.close()
+	os.replace(tempName, globals.EDITS_FILE_NAME)
+
+
+def queueEdit(game):
+	finalText = None
+	if game.status.waitingAction == Action.END:
+		finalText = utils.renderGame(game)
+	with lock:
+		if game.thread not in unsent or unsent[game.thread] != finalText:
+			unsent[game.thread] = finalText
+			saveUnsent()
+		if game.thread in pending:
+			return
+		pending[game.thread] = datetime.utcnow() + timedelta(seconds=globals.THREAD_EDIT_DELAY)
+	log.debug("Queued thread edit for game {}".format(game.thread))
+	scheduler.wake()
+
+
+def getNextDue():
+	with lock:
+		if not len(pending):
+			return None
+		return min(pending.values())
+
+
+def popDueThreads(now=None):
+	with lock:
+		due = []
+		for thread in list(pending.keys()):
+			if now is None or pending[thread] <= now:
+				due.append(thread)
+				del pending[thread]
+		return due
+
+
+def markSent(thread):
+	with lock:
+		if thread in unsent and thread not in pending:
+			del unsent[thread]
+			saveUnsent()
+
+
+def getFinalText(thread):
+	with lock:
+		return unsent.get(thread)
+
+
+def renderEdit(thread):
+	finalText = getFinalText(thread)
+	if finalText is not None:
+		return finalText, None
+	game = index.getGame(thread)
+	if game is None:
+		log.warning("Couldn't find game {} to edit its thread".format(thread))
+		markSent(thread)
+		return None, None
+	threadText = utils.renderGame(game)
+	textHash = hashlib.sha1(threadText.encode()).hexdigest()
+	if lastHashes.get(thread) == textHash:
+		log.debug("Thread for game {} is unchanged, skipping edit".format(thread))
+		markSent(thread)
+		return None, None
+	return threadText, textHash
+
+
+def sendEdit(thread, threadText, textHash):
+	reddit.editThread(thread, threadText)
+	if textHash is None:
+		lastHashes.pop(thread, None)
+	else:
+		lastHashes[thread] = textHash
+	markSent(thread)
+
+
+def renderAndSubmit(thread):
+	threadText, textHash = renderEdit(thread)
+	if threadText is not None:
+		outbound.submit(sendEdit, thread, threadText, textHash)
+
+
+def processDueEdits():
+	for thread in popDueThreads(datetime.utcnow()):
+		if getFinalText(thread) is not None:
+			renderAndSubmit(thread)
+		else:
+			dispatcher.dispatchTask(thread, renderAndSubmit, thread)
+
+
+def flush():
+	for thread in popDueThreads():
+		threadText, textHash = renderEdit(thread)
+		if threadText is not None:
+			sendEdit(thread, threadText, textHash)
@@ -4,12 +4,32 @@ from pytz import timezone
 LOG_FOLDER_NAME = "logs"
 SAVE_FOLDER_NAME = "games"
 ARCHIVE_FOLDER_NAME = "gamesOld"
+MIGRATION_FOLDER_NAME = "migrations"
+JOURNAL_FOLDER_NAME = "journal"
 SUBREDDIT = "FakeCollegeFootball"
 CONFIG_SUBREDDIT = "FakeCollegeFootball"
 USER_AGENT = "FakeCFBRef (by /u/Watchful1)"
 OWNER = "watchful1"
 LOOP_TIME = 2*60
+SCHEDULER_MIN_WAIT = 1
+SCHEDULER_MAX_WAIT = 5*60
+OUTBOUND_THREADS = 8
+SENT_MESSAGE_LOOKBACK = 10
+REDDIT_IO_THREADS = 8
+DISPATCH_THREADS = 8
+REDDIT_REQUESTS_PER_MINUTE = 60
+REDDIT_BURST = 10
+THREAD_EDIT_DELAY = 30
 DATABASE_NAME = "database.db"
+INDEX_FILE_NAME = "gameIndex.pickle"
+SLATE_FILE_NAME = "slate.pickle"
+EDITS_FILE_NAME = "pendingEdits.pickle"
+SLATE_RETRY_DELAY = 5*60
+SLATE_RETRIES = 3
+GAME_CACHE_SIZE = 50
+ARCHIVE_SEGMENT_SIZE = 100
+GAME_LIST_PAGE_SIZE = 50
+FORECAST_SMOOTHING = 0.3
 SUBREDDIT_LINK = "https://www.reddit.com/r/{}/comments/".format(SUBREDDIT)
 MESSAGE_LINK = "https://www.reddit.com/message/messages/"
 ACCOUNT_NAME = "default"
@@ -19,7 +39,3 @@ PASTEBIN_KEY = None
 ### Constants ###
 datatag = " [](#datatag"
 quarterLength = 7*60
-
-### Log ###
-logGameId = ""
-game = None
@@ -1,6 +1,10 @@
 import os
+import bisect
+import heapq
+import pickle
 import logging.handlers
 import traceback
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
 
@@ -9,109 +13,494 @@ import utils
 import wiki
 import reddit
 import messages
+import database
 from classes import Action
+from classes import GameHeader
 
 log = logging.getLogger("bot")
 
-games = {}
+headers = {}
+games = OrderedDict()
+loaded = False
+lock = database.lock
+
+teamTags = {}
+orderedGames = []
+coachSnapshot = {}
+
+schedule = {}
+playclockHeap = []
+warningHeap = []
+storedSchedules = {}
 
 
 def init():
+	global headers
 	global games
-	games = {}
+	global loaded
+	headers = loadHeaders()
+	games = OrderedDict()
+	loaded = True
+
+	gameFiles = set()
 	for gameFile in os.listdir(globals.SAVE_FOLDER_NAME):
-		game = reloadAndReturn(gameFile)
-		if game is not None:
-			changed = False
-			for team in [game.home, game.away]:
-				wikiTeam = wiki.getTeamByTag(team.tag)
-				if ((team.coaches > wikiTeam.coaches) - (team.coaches < wikiTeam.coaches)) != 0:
-					log.debug("Coaches for game {}, team {} changed from {} to {}".format(
-						game.thread,
-						team.tag,
-						team.coaches,
-						wikiTeam.coaches
-					))
-					changed = True
-					team.coaches = wikiTeam.coaches
-
-			if changed:
-				try:
-					log.debug("Reverting status and reprocessing {}".format(game.previousStatus[0].messageId))
-					utils.revertStatus(game, 0)
-					utils.saveGameObject(game)
-					message = reddit.getThingFromFullname(game.status.messageId)
-					if message is None:
-						return "Something went wrong. Not valid fullname: {}".format(game.status.messageId)
-					messages.processMessage(message, True)
-
-					game = reloadAndReturn(game.thread)
-				except Exception as err:
-					log.warning(traceback.format_exc())
-					log.warning("Unable to revert game when changing coaches")
-
-			games[game.thread] = game
-
-
-def getAllGames():
-	allGames = []
-	for thread in games:
-		allGames.append(games[thread])
-	allGames.sort(key=utils.gameSortValue)
-	return allGames
+		if os.path.isfile(os.path.join(globals.SAVE_FOLDER_NAME, gameFile)) and not gameFile.endswith(".tmp"):
+			gameFiles.add(gameFile)
 
+	global teamTags
+	global orderedGames
+	teamTags = {}
+	orderedGames = []
+	for thread in list(headers.keys()):
+		if thread not in gameFiles:
+			log.debug("Game file for {} is gone, dropping header".format(thread))
+			del headers[thread]
+		else:
+			addHeaderLookups(headers[thread])
 
-def addNewGame(game):
+	for gameFile in gameFiles:
+		if gameFile not in headers:
+			log.debug("No header for game {}, loading it".format(gameFile))
+			game = utils.loadGameObject(gameFile)
+			if game is not None and game.status.waitingAction != Action.END:
+				setHeader(GameHeader(game))
+
+	saveHeaders()
+	log.debug("Indexed {} games".format(len(headers)))
+
+	global schedule
+	global playclockHeap
+	global warningHeap
+	global storedSchedules
+	schedule = {}
+	playclockHeap = []
+	warningHeap = []
+	storedSchedules = {}
+	for thread in headers:
+		scheduleGame(thread, headers[thread].playclock, getWarningTime(headers[thread]), headers[thread].errored)
+
+	with database.transaction():
+		for thread in database.getActiveThreads():
+			if thread not in headers:
+				database.completeGame(thread)
+		for thread in headers:
+			updateGameSchedule(headers[thread])
+
+
+def loadHeaders():
+	try:
+		file = open(globals.INDEX_FILE_NAME, 'rb')
+	except FileNotFoundError:
+		log.info("Game index file doesn't exist, rebuilding it")
+		return {}
+	try:
+		loadedHeaders = pickle.load(file)
+	except Exception:
+		log.warning("Couldn't load game index, rebuilding it")
+		log.warning(traceback.format_exc())
+		loadedHeaders = {}
+	file.close()
+
+	for thread in list(loadedHeaders.keys()):
+		if getattr(loadedHeaders[thread], 'format', 0) != GameHeader.formatVersion:
+			del loadedHeaders[thread]
+	return loadedHeaders
+
+
+def saveHeaders():
+	tempName = globals.INDEX_FILE_NAME + ".tmp"
+	file = open(tempName, 'wb')
+	pickle.dump(headers, file)
+	file.close()
+	os.replace(tempName, globals.INDEX_FILE_NAME)
+
+
+def addHeaderLookups(header):
+	bisect.insort(orderedGames, (headerSortValue(header), header.thread))
+	for isHome in [True, False]:
+		teamTags[header.tag(isHome).lower()] = header.thread
+
+
+def removeHeaderLookups(header):
+	entry = (headerSortValue(header), header.thread)
+	position = bisect.bisect_left(orderedGames, entry)
+	if position < len(orderedGames) and orderedGames[position] == entry:
+		del orderedGames[position]
+	for isHome in [True, False]:
+		if teamTags.get(header.tag(isHome).lower()) == header.thread:
+			del teamTags[header.tag(isHome).lower()]
+
+
+def setHeader(header):
+	if header.thread in headers:
+		removeHeaderLookups(headers[header.thread])
+	headers[header.thread] = header
+	addHeaderLookups(header)
+
+
+def removeHeader(thread):
+	if thread in headers:
+		removeHeaderLookups(headers[thread])
+		del headers[thread]
+
+
+def coachesChanged(header):
+	for isHome in [True, False]:
+		wikiTeam = wiki.getTeamByTag(header.tag(isHome))
+		if wikiTeam is not None and header.coaches(isHome) != wikiTeam.coaches:
+			return True
+	return False
+
+
+def takeCoachSnapshot():
+	global coachSnapshot
+	coachSnapshot = {}
+	for tag in wiki.teams:
+		coachSnapshot[tag] = list(wiki.teams[tag].coaches)
+
+
+def syncCoaches():
+	takeCoachSnapshot()
+	syncGamesCoaches([thread for thread in headers if coachesChanged(headers[thread])])
+
+
+def reindexChangedCoaches():
+	previousSnapshot = coachSnapshot
+	takeCoachSnapshot()
+
+	changedTags = []
+	for tag in set(previousSnapshot.keys()) | set(coachSnapshot.keys()):
+		if previousSnapshot.get(tag) != coachSnapshot.get(tag):
+			changedTags.append(tag)
+
+	changedThreads = set()
+	for tag in changedTags:
+		if tag in teamTags and coachesChanged(headers[teamTags[tag]]):
+			changedThreads.add(teamTags[tag])
+	log.debug("Coaches changed for {} teams, {} active games".format(len(changedTags), len(changedThreads)))
+
+	syncGamesCoaches(changedThreads)
+	return changedTags, changedThreads
+
+
+def syncGamesCoaches(threads):
+	if not len(threads):
+		return
+	fullnames = []
+	for thread in threads:
+		game = getGame(thread)
+		if game is not None and len(game.previousStatus):
+			fullnames.append(game.previousStatus[0].messageId)
+
+	with reddit.thingBatch():
+		messages.prefetchMessages([fullname for fullname in fullnames if fullname is not None])
+		for thread in threads:
+			syncGameCoaches(thread)
+
+
+def syncGameCoaches(thread):
+	game = getGame(thread)
+	if game is None:
+		return
+
+	for team in [game.home, game.away]:
+		wikiTeam = wiki.getTeamByTag(team.tag)
+		if wikiTeam is not None and team.coaches != wikiTeam.coaches:
+			log.debug("Coaches for game {}, team {} changed from {} to {}".format(
+				game.thread,
+				team.tag,
+				team.coaches,
+				wikiTeam.coaches
+			))
+			team.coaches = wikiTeam.coaches
+
+	try:
+		log.debug("Reverting status and reprocessing {}".format(game.previousStatus[0].messageId))
+		utils.revertStatus(game, 0)
+		utils.saveGameObject(game)
+		message = reddit.getThingFromFullname(game.status.messageId)
+		if message is None:
+			log.warning("Something went wrong. Not valid fullname: {}".format(game.status.messageId))
+			return
+		messages.processMessage(message, True)
+
+		reloadAndReturn(game.thread)
+	except Exception as err:
+		log.warning(traceback.format_exc())
+		log.warning("Unable to revert game when changing coaches")
+		utils.saveGameObject(game)
+
+
+def cacheGame(game):
 	games[game.thread] = game
+	games.move_to_end(game.thread)
+	while len(games) > globals.GAME_CACHE_SIZE:
+		thread, evicted = games.popitem(last=False)
+		log.debug("Evicted game {} from cache".format(thread))
+
+
+def evictGame(thread):
+	with lock:
+		if thread in games:
+			del games[thread]
+
+
+def getGame(thread):
+	with lock:
+		if thread not in headers:
+			return None
+		if thread in games:
+			if getattr(games[thread], 'version', 0) == headers[thread].version:
+				games.move_to_end(thread)
+				return games[thread]
+			log.debug("Cached game {} is stale, reloading".format(thread))
+			evictGame(thread)
+
+		game = utils.loadGameObject(thread)
+		if game is None:
+			return None
+		cacheGame(game)
+		return game
+
+
+def updateGameHeader(game):
+	if not loaded or game.status.waitingAction == Action.END:
+		return
+	with lock:
+		header = GameHeader(game)
+		setHeader(header)
+		saveHeaders()
+		updateGameSchedule(header)
+		rescheduleGame(game)
+
+
+def getWarningTime(header):
+	if header.playclockWarning:
+		return None
+	return header.playclock - timedelta(hours=12)
+
+
+def updateGameSchedule(header):
+	stored = (header.playclock, header.deadline, getWarningTime(header), header.errored)
+	if storedSchedules.get(header.thread) == stored:
+		return
+	storedSchedules[header.thread] = stored
+	database.updateGameSchedule(header.thread, *stored)
+
+
+def headerSortValue(header):
+	return header.quarter * 1000 + header.clock
+
+
+def getGameList(page=1, pageSize=None, quarter=None, errored=None, waitingOn=None):
+	if pageSize is None:
+		pageSize = globals.GAME_LIST_PAGE_SIZE
+	if waitingOn is not None:
+		waitingOn = waitingOn.lower()
+
+	matching = []
+	for sortValue, thread in orderedGames:
+		header = headers[thread]
+		if quarter is not None and header.quarter != quarter:
+			continue
+		if errored is not None and header.errored != errored:
+			continue
+		if waitingOn is not None and header.waitingOnTag.lower() != waitingOn:
+			continue
+		matching.append(header)
+
+	start = (page - 1) * pageSize
+	return matching[start:start + pageSize], len(matching)
+
+
+def getProjectedFinish(header, now=None):
+	if header.secondsPerClock is None or header.remainingClock is None:
+		return None
+	if now is None:
+		now = datetime.utcnow()
+	projected = now + timedelta(seconds=header.remainingClock * header.secondsPerClock)
+	return max(projected, header.projectedFinish)
+
+
+def getAtRiskGames():
+	now = datetime.utcnow()
+	atRisk = []
+	for sortValue, thread in orderedGames:
+		header = headers[thread]
+		projected = getProjectedFinish(header, now)
+		if projected is not None and projected > header.deadline:
+			atRisk.append((header, projected))
+	atRisk.sort(key=lambda entry: entry[0].deadline)
+	return atRisk
+
+
+def addNewGame(game):
+	with lock:
+		cacheGame(game)
+		updateGameHeader(game)
 
 
 def reloadAndReturn(thread):
 	game = utils.loadGameObject(thread)
+	if game is None:
+		return None
 	if game.status.waitingAction != Action.END:
-		games[game.thread] = game
+		with lock:
+			cacheGame(game)
+			updateGameHeader(game)
 		return game
 	else:
 		return None
 
 
+def scheduleGame(thread, playclock, warning, errored):
+	if errored:
+		playclock = None
+		warning = None
+	if schedule.get(thread) == (playclock, warning):
+		return
+	schedule[thread] = (playclock, warning)
+	if playclock is not None:
+		heapq.heappush(playclockHeap, (playclock, thread))
+	if warning is not None:
+		heapq.heappush(warningHeap, (warning, thread))
+
+	if len(playclockHeap) + len(warningHeap) > (len(schedule) + 10) * 4:
+		rebuildHeaps()
+
+
+def rescheduleGame(game):
+	if not loaded:
+		return
+	with lock:
+		if game.thread not in headers or game.status.waitingAction == Action.END:
+			unscheduleGame(game.thread)
+			return
+		warning = None if game.playclockWarning else game.playclock - timedelta(hours=12)
+		scheduleGame(game.thread, game.playclock, warning, game.errored)
+
+
+def unscheduleGame(thread):
+	with lock:
+		if thread in schedule:
+			del schedule[thread]
+
+
+def rebuildHeaps():
+	global playclockHeap
+	global warningHeap
+	playclockHeap = [(times[0], thread) for thread, times in schedule.items() if times[0] is not None]
+	warningHeap = [(times[1], thread) for thread, times in schedule.items() if times[1] is not None]
+	heapq.heapify(playclockHeap)
+	heapq.heapify(warningHeap)
+
+
+def popDueThreads(heap, position, now):
+	due = []
+	seen = set()
+	while len(heap) and heap[0][0] < now:
+		entry = heapq.heappop(heap)
+		times = schedule.get(entry[1])
+		if times is not None and times[position] == entry[0] and entry not in seen:
+			seen.add(entry)
+			due.append(entry)
+	for entry in due:
+		heapq.heappush(heap, entry)
+	return [entry[1] for entry in due]
+
+
+def getNextPlayclock():
+	with lock:
+		while len(playclockHeap):
+			playclock, thread = playclockHeap[0]
+			times = schedule.get(thread)
+			if times is not None and times[0] == playclock:
+				return playclock
+			heapq.heappop(playclockHeap)
+		return None
+
+
+def getNextPlayclockWarning():
+	with lock:
+		while len(warningHeap):
+			warning, thread = warningHeap[0]
+			times = schedule.get(thread)
+			if times is not None and times[1] == warning:
+				return warning
+			heapq.heappop(warningHeap)
+		return None
+
+
+def getDueThreads(heap, position, now, dueThreads):
+	with lock:
+		seen = set(dueThreads)
+		for thread in popDueThreads(heap, position, now):
+			if thread not in seen:
+				seen.add(thread)
+				dueThreads.append(thread)
+	return dueThreads
+
+
 def getGamesPastPlayclock():
 	pastPlayclock = []
-	for thread in games:
-		game = games[thread]
-		if not game.errored and game.playclock < datetime.utcnow():
+	now = datetime.utcnow()
+	dueThreads = getDueThreads(playclockHeap, 0, now, database.getGamesPastPlayclock(now))
+	for thread in dueThreads:
+		game = getGame(thread)
+		if game is None:
+			unscheduleGame(thread)
+			database.completeGame(thread)
+		elif game.playclock < now and not game.errored:
 			pastPlayclock.append(game)
+		else:
+			log.debug("Schedule for game {} is stale, rescheduling".format(thread))
+			updateGameHeader(game)
 	return pastPlayclock
 
 
 def getGamesPastPlayclockWarning():
 	pastPlayclock = []
-	for thread in games:
-		game = games[thread]
-		if not game.errored and not game.playclockWarning and game.playclock - timedelta(hours=12) < datetime.utcnow():
+	now = datetime.utcnow()
+	dueThreads = getDueThreads(warningHeap, 1, now, database.getGamesPastPlayclockWarning(now))
+	for thread in dueThreads:
+		game = getGame(thread)
+		if game is None:
+			unscheduleGame(thread)
+			database.completeGame(thread)
+		elif game.playclock - timedelta(hours=12) < now and not game.playclockWarning and not game.errored:
 			pastPlayclock.append(game)
+		else:
+			log.debug("Warning schedule for game {} is stale, rescheduling".format(thread))
+			updateGameHeader(game)
 	return pastPlayclock
 
 
 def endGame(game):
-	if game.thread in games:
-		del games[game.thread]
-	utils.archiveGameFile(game.thread)
+	with lock:
+		evictGame(game.thread)
+		if game.thread in headers:
+			removeHeader(game.thread)
+			saveHeaders()
+		unscheduleGame(game.thread)
+		storedSchedules.pop(game.thread, None)
+	database.completeGame(game.thread)
 
 
 def setGameErrored(game):
 	game.errored = True
 	game.playclock = datetime.utcnow()
+	rescheduleGame(game)
 
 
 def clearGameErrored(game):
 	game.errored = False
 	game.deadline = game.deadline + (datetime.utcnow() - game.playclock)
 	game.playclock = datetime.utcnow() + timedelta(hours=24)
+	rescheduleGame(game)
 
 
-def getGameFromTeamTag(tag):
-	for thread in games:
-		game = games[thread]
-		if game.home.tag == tag or game.away.tag == tag:
-			return game
-	return None
+def getHeaderFromTeamTag(tag):
+	thread = teamTags.get(tag.lower())
+	if thread is None:
+		return None
+	return headers.get(thread)
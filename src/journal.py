@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import pickle
+import traceback
+import logging.handlers
+
+import globals
+import utils
+import index
+import reddit
+import messages
+import scheduler
+import context
+
+log = logging.getLogger("bot")
+
+OUTBOUND_STEPS = ['post', 'comment', 'message', 'reply']
+
+held = set()
+
+
+def logPath(entryId):
+	return os.path.join(globals.JOURNAL_FOLDER_NAME, "{}.log".format(entryId))
+
+
+def snapshotPath(entryId):
+	return os.path.join(globals.JOURNAL_FOLDER_NAME, "{}.snapshot".format(entryId))
+
+
+def writeLine(entryId, line):
+	file = open(logPath(entryId), 'a')
+	file.write(json.dumps(line) + "\n")
+	file.flush()
+	os.fsync(file.fileno())
+	file.close()
+
+
+def getCurrent():
+	return context.journalEntry.get()
+
+
+def begin(entryId, game, messageFullname=None):
+	if getCurrent() is not None:
+		log.warning("Starting journal entry {} while {} is still open, discarding it".format(entryId, getCurrent()))
+		commit()
+
+	file = open(snapshotPath(entryId), 'wb')
+	pickle.dump(game, file)
+	file.flush()
+	os.fsync(file.fileno())
+	file.close()
+
+	context.journalEntry.set(entryId)
+	writeLine(entryId, {'step': 'begin', 'thread': game.thread, 'message': messageFullname, 'time': time.time()})
+
+
+def detach():
+	entryId = getCurrent()
+	context.journalEntry.set(None)
+	return entryId
+
+
+def resume(entryId):
+	context.journalEntry.set(entryId)
+
+
+def record(step, value=None):
+	if getCurrent() is None:
+		return
+	writeLine(getCurrent(), {'step': step, 'value': value})
+
+
+def hold():
+	if getCurrent() is not None:
+		held.add(getCurrent())
+
+
+def release(entryId, read):
+	resume(entryId)
+	if read:
+		record('read')
+	held.discard(entryId)
+	commit()
+
+
+def releaseRead(items, marked):
+	markedIds = set([entryId for message, entryId in marked])
+	for message, entryId in items:
+		if entryId in held:
+			release(entryId, entryId in markedIds)
+
+
+def commit():
+	if getCurrent() is None:
+		return
+	if getCurrent() in held:
+		context.journalEntry.set(None)
+		return
+	for path in [logPath(getCurrent()), snapshotPath(getCurrent())]:
+		if os.path.exists(path):
+			os.remove(path)
+	context.journalEntry.set(None)
+
+
+def readEntry(entryId):
+	steps = []
+	file = open(logPath(entryId), 'r')
+	for line in file:
+		try:
+			steps.append(json.loads(line))
+		except ValueError:
+			log.warning("Skipping torn journal line in {}".format(entryId))
+	file.close()
+	return steps
+
+
+def isRead(steps):
+	return any(step['step'] == 'read' for step in steps)
+
+
+def isSavedAfterOutbound(steps):
+	lastSave = -1
+	lastOutbound = -1
+	for i, step in enumerate(steps):
+		if step['step'] == 'save':
+			lastSave = i
+		elif step['step'] in OUTBOUND_STEPS:
+			lastOutbound = i
+	return lastSave > lastOutbound
+
+
+def getSavedIntent(steps):
+	intent = None
+	for step in steps:
+		if step['step'] == 'intent':
+			intent = step['value']
+		elif step['step'] == 'save' and intent is not None:
+			return intent
+	return None
+
+
+def getCompletedSteps(steps):
+	completed = {}
+	for step in steps:
+		if step['step'] in OUTBOUND_STEPS:
+			completed[step['step']] = step.get('value')
+	return completed
+
+
+def rollForward(entryId, thread, steps):
+	game = utils.loadGameObject(thread)
+	if game is None:
+		log.warning("Can't roll forward {}, game file is missing".format(thread))
+		return
+
+	intent = getSavedIntent(steps)
+	if intent is not None:
+		log.info("Replaying outstanding actions for {}".format(thread))
+		scheduler.dispatchPenalty(game, intent, entryId, getCompletedSteps(steps))
+	elif steps[-1]['step'] != 'thread':
+		log.info("Replaying thread edit for {}".format(thread))
+		utils.updateGameThread(game)
+
+
+def loadSnapshot(entryId):
+	try:
+		file = open(snapshotPath(entryId), 'rb')
+	except FileNotFoundError:
+		return None
+	game = pickle.load(file)
+	file.close()
+	return game
+
+
+def rollBack(entryId, game, messageFullname, steps):
+	log.info("Rolling back game {} to before {}".format(game.thread, entryId))
+	utils.saveGameObject(game)
+	index.reloadAndReturn(game.thread)
+
+	if messageFullname is not None and isRead(steps):
+		log.info("Reprocessing message {}".format(messageFullname))
+		message = reddit.getThingFromFullname(messageFullname)
+		if message is None:
+			log.warning("Something went wrong. Not valid fullname: {}".format(messageFullname))
+			return
+		messages.processMessage(message, True)
+
+
+def recover():
+	if not os.path.exists(globals.JOURNAL_FOLDER_NAME):
+		os.makedirs(globals.JOURNAL_FOLDER_NAME)
+
+	entries = []
+	for fileName in os.listdir(globals.JOURNAL_FOLDER_NAME):
+		if not fileName.endswith(".log"):
+			continue
+		entryId = fileName[:-len(".log")]
+		steps = readEntry(entryId)
+		if not len(steps) or steps[0]['step'] != 'begin':
+			log.warning("Journal entry {} has no begin record, discarding".format(entryId))
+			resume(entryId)
+			commit()
+			continue
+		entries.append((steps[0].get('time', 0), entryId, steps))
+	entries.sort(key=lambda entry: entry[0])
+
+	rolledBack = set()
+	for startTime, entryId, steps in entries:
+		thread = steps[0]['thread']
+		messageFullname = steps[0]['message']
+		snapshot = loadSnapshot(entryId)
+		resume(entryId)
+		commit()
+
+		log.info("Recovering incomplete journal entry {} for game {}".format(entryId, thread))
+		utils.setLogGameID(thread, None)
+		try:
+			if messageFullname is not None and not isRead(steps):
+				if thread in rolledBack:
+					log.info("Game {} was already rolled back to before an earlier unread message".format(thread))
+				elif snapshot is not None:
+					rolledBack.add(thread)
+					rollBack(entryId, snapshot, messageFullname, steps)
+				else:
+					log.warning("No snapshot for journal entry {}, can't roll back".format(entryId))
+			elif isSavedAfterOutbound(steps) or getSavedIntent(steps) is not None:
+				rollForward(entryId, thread, steps)
+			elif snapshot is not None:
+				rollBack(entryId, snapshot, messageFullname, steps)
+			else:
+				log.warning("No snapshot for journal entry {}, can't roll back".format(entryId))
+		except Exception:
+			log.warning("Unable to recover journal entry {}".format(entryId))
+			log.warning(traceback.format_exc())
+		utils.clearLogGameID()
+
+	for fileName in os.listdir(globals.JOURNAL_FOLDER_NAME):
+		if fileName.endswith(".snapshot") and not os.path.exists(logPath(fileName[:-len(".snapshot")])):
+			os.remove(os.path.join(globals.JOURNAL_FOLDER_NAME, fileName))
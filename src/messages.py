@@ -1,4 +1,5 @@
 import logging.handlers
+import math
 import re
 import praw
 
@@ -9,6 +10,9 @@ import globals
 import state
 import classes
 import index
+import journal
+import slate
+import ratelimit
 from classes import Play
 from classes import Action
 from classes import TimeoutOption
@@ -288,6 +292,7 @@ def processMessageOffensePlay(game, message, author):
 	game.status.waitingOn.reverse()
 	game.dirty = True
 	utils.setGamePlayed(game)
+	utils.updateForecast(game)
 	if game.status.waitingAction in classes.playActions:
 		utils.sendDefensiveNumberMessage(game)
 	elif game.status.waitingAction == Action.OVERTIME:
@@ -302,6 +307,21 @@ def processMessageOffensePlay(game, message, author):
 	return success, utils.embedTableInMessage('\n\n'.join(result), utils.getActionTable(game, game.status.waitingAction))
 
 
+def prefetchMessages(fullnames):
+	reddit.prefetchThings(fullnames)
+	prefetchParents([reddit.thingCache[fullname] for fullname in fullnames if fullname in reddit.thingCache])
+
+
+def prefetchParents(things):
+	parents = []
+	for thing in things:
+		if thing.parent_id is None or not thing.parent_id.startswith("t1"):
+			continue
+		if utils.getThingTable(thing.parent_id) is None:
+			parents.append(thing.parent_id)
+	reddit.prefetchThings(parents)
+
+
 def processMessageKickGame(body):
 	log.debug("Processing kick game message")
 	threadIds = re.findall('([\da-z]{6})', body)
@@ -310,11 +330,10 @@ def processMessageKickGame(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = utils.loadGameObject(threadIds[0])
+	game = index.reloadAndReturn(threadIds[0])
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
-	game = index.reloadAndReturn(threadIds[0])
 	index.clearGameErrored(game)
 	utils.saveGameObject(game)
 	result = ["Kicked game: {}".format(threadIds[0])]
@@ -326,14 +345,16 @@ def processMessageKickGame(body):
 		utils.saveGameObject(game)
 		result.append("Reverted to status: {}".format(statusIndex[0]))
 
-	messageFullname = re.findall('(?:message:)(t\d_[\da-z]{6,})', body)
-	if len(messageFullname) > 0:
-		log.debug("Reprocessing message/comment: {}".format(messageFullname[0]))
-		message = reddit.getThingFromFullname(messageFullname[0])
-		if message is None:
-			return "Something went wrong. Not valid fullname: {}".format(messageFullname[0])
-		processMessage(message, True)
-		result.append("Reprocessed message: {}".format(messageFullname[0]))
+	messageFullnames = re.findall('(?:message:)(t\d_[\da-z]{6,})', body)
+	with reddit.thingBatch():
+		prefetchMessages(messageFullnames)
+		for messageFullname in messageFullnames:
+			log.debug("Reprocessing message/comment: {}".format(messageFullname))
+			message = reddit.getThingFromFullname(messageFullname)
+			if message is None:
+				return "Something went wrong. Not valid fullname: {}".format(messageFullname)
+			processMessage(message, True)
+			result.append("Reprocessed message: {}".format(messageFullname))
 
 	log.debug("Finished kicking game")
 	return '\n\n'.join(result)
@@ -353,7 +374,10 @@ def processMessagePauseGame(body):
 		return "Couldn't find a number of hours in message"
 	log.debug("Found hours: {}".format(hours[0]))
 
-	game = index.reloadAndReturn(threadIds[0])
+	game = index.getGame(threadIds[0])
+	if game is None:
+		return "Game not found: {}".format(threadIds[0])
+
 	utils.pauseGame(game, int(hours[0]))
 	utils.saveGameObject(game)
 
@@ -368,7 +392,7 @@ def processMessageAbandonGame(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = utils.loadGameObject(threadIds[0])
+	game = index.getGame(threadIds[0])
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
@@ -387,7 +411,9 @@ def processMessageGameStatus(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = utils.loadGameObject(threadIds[0])
+	game = index.getGame(threadIds[0])
+	if game is None:
+		game = utils.loadGameObject(threadIds[0])
 	if game is None:
 		return "Game {} doesn't exist".format(threadIds[0])
 	else:
@@ -397,8 +423,13 @@ def processMessageGameStatus(body):
 def processMessageReindex(body):
 	log.debug("Processing reindex message")
 	wiki.loadPages(True)
-	index.init()
-	return "Wiki pages reloaded and games reindexed"
+	if "full" in body.lower():
+		index.init()
+		index.syncCoaches()
+		return "Wiki pages reloaded and games reindexed"
+
+	changedTags, changedThreads = index.reindexChangedCoaches()
+	return "Wiki pages reloaded. Coaches changed for {} teams, {} games updated".format(len(changedTags), len(changedThreads))
 
 
 def processMessageDefaultChew(body):
@@ -409,7 +440,7 @@ def processMessageDefaultChew(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = utils.loadGameObject(threadIds[0])
+	game = index.getGame(threadIds[0])
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
@@ -426,24 +457,81 @@ def processMessageDefaultChew(body):
 	return result
 
 
+def processMessageSchedule(body):
+	log.debug("Processing schedule message")
+	pageNames = re.findall('(?:page:)([\w-]+)', body)
+	pageName = pageNames[0] if len(pageNames) else "schedule"
+
+	count = slate.loadScheduleFromWiki(pageName)
+	nextStart = slate.getNextStart()
+	if nextStart is None:
+		return "Queued {} games from the {} wiki page, nothing pending".format(count, pageName)
+	return "Queued {} games from the {} wiki page. {} games pending, next starts {}".format(
+		count, pageName, len(slate.pending), utils.renderDatetime(nextStart))
+
+
 def processMessageGameList(body):
 	log.debug("Processing game list message")
 
+	page = 1
+	quarter = None
+	errored = None
+	waitingOn = None
+	for match in re.finditer('(page|quarter|waiting)(?::)(\w+)', body.lower()):
+		if match.group(1) == "page" and match.group(2).isdigit():
+			page = max(int(match.group(2)), 1)
+		elif match.group(1) == "quarter" and match.group(2).isdigit():
+			quarter = int(match.group(2))
+		elif match.group(1) == "waiting":
+			waitingOn = match.group(2)
+	if "errored" in body.lower():
+		errored = True
+
 	bldr = ['Teams|Link|Quarter|Clock\n:-:|:-:|:-:|:-:\n']
-	games = index.getAllGames()
-	log.debug("Listing {} games".format(len(games)))
-	for game in games:
-		bldr.append(game.away.name)
+	games, total = index.getGameList(page, quarter=quarter, errored=errored, waitingOn=waitingOn)
+	log.debug("Listing {} of {} games".format(len(games), total))
+	for header in games:
+		bldr.append(header.awayName)
+		bldr.append(" vs ")
+		bldr.append(header.homeName)
+		bldr.append("|[Link](")
+		bldr.append(utils.getLinkToThread(header.thread))
+		bldr.append(")|")
+		bldr.append(str(header.quarter))
+		bldr.append("|")
+		bldr.append(utils.renderTime(header.clock))
+		bldr.append("\n")
+
+	pages = max(math.ceil(total / globals.GAME_LIST_PAGE_SIZE), 1)
+	bldr.append("\nPage {} of {}, {} games".format(page, pages, total))
+
+	return ''.join(bldr)
+
+
+def processMessageAtRisk(body):
+	log.debug("Processing at risk message")
+
+	bldr = ['Teams|Link|Quarter|Clock|Projected|Deadline\n:-:|:-:|:-:|:-:|:-:|:-:\n']
+	atRisk = index.getAtRiskGames()
+	log.debug("Found {} games projected to miss their deadline".format(len(atRisk)))
+	for header, projected in atRisk:
+		bldr.append(header.awayName)
 		bldr.append(" vs ")
-		bldr.append(game.home.name)
+		bldr.append(header.homeName)
 		bldr.append("|[Link](")
-		bldr.append(utils.getLinkToThread(game.thread))
+		bldr.append(utils.getLinkToThread(header.thread))
 		bldr.append(")|")
-		bldr.append(str(game.status.quarter))
+		bldr.append(str(header.quarter))
 		bldr.append("|")
-		bldr.append(utils.renderTime(game.status.clock))
+		bldr.append(utils.renderTime(header.clock))
+		bldr.append("|")
+		bldr.append(utils.renderDatetime(projected, False))
+		bldr.append("|")
+		bldr.append(utils.renderDatetime(header.deadline, False))
 		bldr.append("\n")
 
+	bldr.append("\n{} games projected to miss their deadline".format(len(atRisk)))
+
 	return ''.join(bldr)
 
 
@@ -461,27 +549,29 @@ def processMessage(message, force=False):
 	dataTable = None
 
 	if message.parent_id is not None and (message.parent_id.startswith("t1") or message.parent_id.startswith("t4")):
-		if isMessage:
-			parent = reddit.getMessage(message.parent_id[3:])
+		dataTable = utils.getThingTable(message.parent_id)
+		if dataTable is not None:
+			log.debug("Found parent {} in local store".format(message.parent_id))
 		else:
-			parent = reddit.getComment(message.parent_id[3:])
+			parent = reddit.getThingFromFullname(message.parent_id)
+			if parent is not None and str(parent.author).lower() == globals.ACCOUNT_NAME:
+				dataTable = utils.extractTableFromMessage(parent.body)
 
-		if parent is not None and str(parent.author).lower() == globals.ACCOUNT_NAME:
-			dataTable = utils.extractTableFromMessage(parent.body)
-			if dataTable is not None:
-				if 'action' not in dataTable or 'thread' not in dataTable:
-					dataTable = None
-				else:
-					dataTable['source'] = parent.fullname
-					log.debug("Found a valid datatable in parent message: {}".format(str(dataTable)))
+		if dataTable is not None:
+			if 'action' not in dataTable or 'thread' not in dataTable:
+				dataTable = None
+			else:
+				dataTable['source'] = message.parent_id
+				log.debug("Found a valid datatable in parent message: {}".format(str(dataTable)))
 
 	body = message.body.lower()
 	author = str(message.author)
 	game = None
 	appendMessageId = False
 	if dataTable is not None:
-		game = index.reloadAndReturn(dataTable['thread'])
+		game = index.getGame(dataTable['thread'])
 		if game is not None:
+			journal.begin(message.fullname, game, message.fullname)
 			utils.cycleStatus(game, message.fullname)
 			utils.setLogGameID(game.thread, game)
 
@@ -553,8 +643,17 @@ def processMessage(message, force=False):
 				response = processMessageDefaultChew(message.body)
 			elif body.startswith("gamelist"):
 				response = processMessageGameList(message.body)
-
-	message.mark_read()
+			elif body.startswith("schedule"):
+				response = processMessageSchedule(message.body)
+			elif body.startswith("atrisk"):
+				response = processMessageAtRisk(message.body)
+			elif body.startswith("ratelimit"):
+				response = ratelimit.getStats()
+
+	if reddit.markRead(message, journal.getCurrent()):
+		journal.hold()
+	else:
+		journal.record('read')
 	if response is not None:
 		if success is not None and not success and dataTable is not None and utils.extractTableFromMessage(
 				response) is None:
@@ -566,6 +665,8 @@ def processMessage(message, force=False):
 				else:
 					utils.setWaitingId(game, 'return')
 		resultMessage = reddit.replyMessage(message, response)
+		journal.record('reply', resultMessage.fullname if resultMessage is not None else None)
+		utils.recordThing(resultMessage, utils.extractTableFromMessage(response))
 		if resultMessage is None:
 			log.warning("Could not send message")
 
@@ -588,3 +689,7 @@ def processMessage(message, force=False):
 	if game is not None and game.dirty:
 		log.debug("Game is dirty, updating thread")
 		utils.updateGameThread(game)
+	elif game is not None:
+		index.evictGame(game.thread)
+
+	journal.commit()
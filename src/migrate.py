@@ -0,0 +1,92 @@
+import os
+import time
+import traceback
+import logging.handlers
+import multiprocessing
+
+import globals
+import utils
+
+log = logging.getLogger("bot")
+
+PROGRESS_INTERVAL = 100
+
+
+def checkpointPath(name):
+	return os.path.join(globals.MIGRATION_FOLDER_NAME, "{}.checkpoint".format(name))
+
+
+def loadCheckpoint(name):
+	try:
+		file = open(checkpointPath(name), 'r')
+	except FileNotFoundError:
+		return set()
+	done = set(line.strip() for line in file if line.strip() != "")
+	file.close()
+	return done
+
+
+def migrateFile(args):
+	migration, fileName, save, dryRun = args
+	try:
+		game = utils.loadGameObject(fileName)
+		if game is None:
+			return fileName, None, "Game file doesn't exist"
+		result = migration(game)
+		if result and save and not dryRun:
+			utils.saveGameObject(game)
+		return fileName, result, None
+	except Exception:
+		return fileName, None, traceback.format_exc()
+
+
+def runMigration(name, migration, save=True, dryRun=False, onResult=None, processes=None):
+	folder = globals.SAVE_FOLDER_NAME
+	if not os.path.exists(globals.MIGRATION_FOLDER_NAME):
+		os.makedirs(globals.MIGRATION_FOLDER_NAME)
+
+	done = set() if dryRun else loadCheckpoint(name)
+	fileNames = []
+	for fileName in os.listdir(folder):
+		if os.path.isfile(os.path.join(folder, fileName)) and not fileName.endswith(".tmp") and fileName not in done:
+			fileNames.append(fileName)
+	log.info("Running migration {}{} on {} games, {} already done".format(
+		name, " (dry run)" if dryRun else "", len(fileNames), len(done)))
+
+	checkpoint = None if dryRun else open(checkpointPath(name), 'a')
+	processed = 0
+	changed = 0
+	errors = 0
+	startTime = time.perf_counter()
+	with multiprocessing.Pool(processes) as pool:
+		work = [(migration, fileName, save, dryRun) for fileName in fileNames]
+		for fileName, result, error in pool.imap_unordered(migrateFile, work, chunksize=8):
+			processed += 1
+			if error is not None:
+				errors += 1
+				log.warning("Migration {} failed on {}: {}".format(name, fileName, error))
+				continue
+
+			if result:
+				changed += 1
+				if onResult is not None and not dryRun:
+					onResult(fileName, result)
+
+			if checkpoint is not None:
+				checkpoint.write(fileName + "\n")
+				checkpoint.flush()
+
+			if processed % PROGRESS_INTERVAL == 0:
+				elapsed = time.perf_counter() - startTime
+				log.info("Migration {}: {}/{} games, {:.1f} games/sec".format(
+					name, processed, len(fileNames), processed / elapsed if elapsed > 0 else 0))
+
+	if checkpoint is not None:
+		checkpoint.close()
+		if errors == 0:
+			os.remove(checkpointPath(name))
+
+	elapsed = time.perf_counter() - startTime
+	log.info("Migration {} finished in {:.1f} seconds: {} processed, {} changed, {} errors".format(
+		name, elapsed, processed, changed, errors))
+	return processed, changed, errors
@@ -0,0 +1,30 @@
+import traceback
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+import context
+
+log = logging.getLogger("bot")
+
+executor = None
+
+
+def getExecutor():
+	global executor
+	if executor is None:
+		executor = ThreadPoolExecutor(max_workers=globals.OUTBOUND_THREADS, thread_name_prefix="outbound")
+	return executor
+
+
+def run(function, *args):
+	try:
+		return function(*args)
+	except Exception:
+		log.warning("Error in outbound work")
+		log.warning(traceback.format_exc())
+		raise
+
+
+def submit(function, *args):
+	return getExecutor().submit(context.capture().run, run, function, *args)
@@ -0,0 +1,85 @@
+import time
+import heapq
+import itertools
+import threading
+import logging.handlers
+
+import globals
+
+log = logging.getLogger("bot")
+
+REPLY = 0
+MESSAGE = 1
+EDIT = 2
+BULK = 3
+PRIORITY_NAMES = ["reply", "message", "edit", "bulk"]
+
+condition = threading.Condition()
+waiting = []
+counter = itertools.count()
+tokens = globals.REDDIT_BURST
+lastRefill = time.monotonic()
+
+requestCounts = [0] * len(PRIORITY_NAMES)
+totalWaits = [0.0] * len(PRIORITY_NAMES)
+maxWaits = [0.0] * len(PRIORITY_NAMES)
+
+
+def refill():
+	global tokens
+	global lastRefill
+	now = time.monotonic()
+	tokens = min(globals.REDDIT_BURST, tokens + (now - lastRefill) * globals.REDDIT_REQUESTS_PER_MINUTE / 60)
+	lastRefill = now
+
+
+def acquire(priority):
+	global tokens
+	entry = (priority, next(counter))
+	queued = time.monotonic()
+	with condition:
+		heapq.heappush(waiting, entry)
+		while True:
+			refill()
+			if waiting[0] == entry and tokens >= 1:
+				break
+			if waiting[0] == entry:
+				condition.wait((1 - tokens) * 60 / globals.REDDIT_REQUESTS_PER_MINUTE)
+			else:
+				condition.wait()
+
+		heapq.heappop(waiting)
+		tokens -= 1
+		waited = time.monotonic() - queued
+		requestCounts[priority] += 1
+		totalWaits[priority] += waited
+		maxWaits[priority] = max(maxWaits[priority], waited)
+		condition.notify_all()
+
+	if waited > 5:
+		log.debug("Waited {:.1f} seconds for a {} request".format(waited, PRIORITY_NAMES[priority]))
+
+
+def getQueueDepths():
+	with condition:
+		refill()
+		depths = [0] * len(PRIORITY_NAMES)
+		for priority, order in waiting:
+			depths[priority] += 1
+		return depths
+
+
+def getStats():
+	depths = getQueueDepths()
+	bldr = ['Priority|Queued|Requests|Average wait|Max wait\n:-:|:-:|:-:|:-:|:-:\n']
+	for priority, name in enumerate(PRIORITY_NAMES):
+		average = totalWaits[priority] / requestCounts[priority] if requestCounts[priority] else 0
+		bldr.append("{}|{}|{}|{:.1f}s|{:.1f}s\n".format(
+			name,
+			depths[priority],
+			requestCounts[priority],
+			average,
+			maxWaits[priority]
+		))
+	bldr.append("\n{:.1f} tokens available".format(tokens))
+	return ''.join(bldr)
@@ -1,12 +1,22 @@
 import logging.handlers
+import re
+import time
 import praw
 import configparser
+import threading
 import traceback
+from contextlib import contextmanager
 
 import globals
+import ratelimit
+import aio
 
 log = logging.getLogger("bot")
 reddit = None
+thingCache = {}
+batchDepth = 0
+readBatch = None
+readLock = threading.Lock()
 
 
 def init(user):
@@ -34,39 +44,58 @@ def init(user):
 
 
 def getMessages():
-	return reddit.inbox.unread(limit=100)
+	ratelimit.acquire(ratelimit.BULK)
+	return list(reddit.inbox.unread(limit=100))
 
 
 def getMessage(id):
+	ratelimit.acquire(ratelimit.REPLY)
 	try:
 		return reddit.inbox.message(id)
 	except Exception:
 		return None
 
 
-def sendMessage(recipients, subject, message):
-	if not isinstance(recipients, list):
-		recipients = [recipients]
-	results = []
-	for recipient in recipients:
-		try:
-			reddit.redditor(recipient).message(
-				subject=subject,
-				message=message
-			)
-			results.append(getRecentSentMessage())
-		except praw.exceptions.APIException:
-			log.warning("User "+recipient+" doesn't exist")
-			return []
-		except Exception:
-			log.warning("Couldn't sent message to "+recipient)
-			log.warning(traceback.format_exc())
-			return []
+def sendSingleMessage(recipient, subject, message, priority):
+	ratelimit.acquire(priority)
+	try:
+		reddit.redditor(recipient).message(
+			subject=subject,
+			message=message
+		)
+		return True
+	except praw.exceptions.APIException:
+		log.warning("User "+recipient+" doesn't exist")
+		return False
+	except Exception:
+		log.warning("Couldn't sent message to "+recipient)
+		log.warning(traceback.format_exc())
+		return False
+
+
+def sendMessages(recipients, subject, message, priority=ratelimit.MESSAGE):
+	if len(recipients) == 1:
+		sent = [recipient for recipient in recipients if sendSingleMessage(recipient, subject, message, priority)]
+	else:
+		results = aio.gather(*[sendSingleMessageAsync(recipient, subject, message, priority) for recipient in recipients])
+		sent = [recipient for recipient, result in zip(recipients, results) if result]
 
+	found = getSentMessages(sent, subject, priority)
+	results = {}
+	for recipient in recipients:
+		results[recipient] = found.get(recipient.lower())
 	return results
 
 
+def sendMessage(recipients, subject, message, priority=ratelimit.MESSAGE):
+	if not isinstance(recipients, list):
+		recipients = [recipients]
+	results = sendMessages(recipients, subject, message, priority)
+	return [results[recipient] for recipient in recipients if results[recipient] is not None]
+
+
 def replySubmission(id, message):
+	ratelimit.acquire(ratelimit.REPLY)
 	try:
 		submission = getSubmission(id)
 		resultComment = submission.reply(message)
@@ -77,33 +106,110 @@ def replySubmission(id, message):
 
 
 def getWikiPage(subreddit, pageName):
+	ratelimit.acquire(ratelimit.BULK)
 	wikiPage = reddit.subreddit(subreddit).wiki[pageName]
 
 	return wikiPage.content_md
 
 
 def submitSelfPost(subreddit, title, text):
+	ratelimit.acquire(ratelimit.BULK)
 	return reddit.subreddit(subreddit).submit(title=title, selftext=text)
 
 
+def getRateLimitSeconds(err):
+	match = re.search('(?:try again in )(\d+) (minute|second)', str(err))
+	if match is None:
+		return None
+	if match.group(2) == "minute":
+		return int(match.group(1)) * 60
+	else:
+		return int(match.group(1))
+
+
+def submitSelfPostRetry(subreddit, title, text, retries=3):
+	for attempt in range(retries):
+		try:
+			return submitSelfPost(subreddit, title, text)
+		except praw.exceptions.APIException as err:
+			seconds = getRateLimitSeconds(err)
+			if seconds is None or attempt == retries - 1:
+				raise
+			log.info("Rate limited submitting post, waiting {} seconds".format(seconds + 1))
+			time.sleep(seconds + 1)
+
+
 def getSubmission(id):
 	return reddit.submission(id=id)
 
 
 def editThread(id, text):
+	ratelimit.acquire(ratelimit.EDIT)
 	submission = getSubmission(id)
 	submission.edit(text)
 
 
 def getComment(id):
-	return reddit.comment(id)
+	ratelimit.acquire(ratelimit.REPLY)
+	comment = reddit.comment(id)
+	try:
+		comment.parent_id
+	except Exception:
+		return None
+	return comment
 
 
 def getMessageStream():
-	return reddit.inbox.stream()
+	ratelimit.acquire(ratelimit.BULK)
+	for message in reddit.inbox.stream(pause_after=-1):
+		if message is None:
+			ratelimit.acquire(ratelimit.BULK)
+		else:
+			yield message
+
+
+def markRead(message, entryId=None, deferrable=True):
+	with readLock:
+		if deferrable and readBatch is not None:
+			readBatch.append((message, entryId))
+			return True
+	ratelimit.acquire(ratelimit.REPLY)
+	message.mark_read()
+	return False
+
+
+def markReadBatch(items):
+	marked = []
+	for start in range(0, len(items), 25):
+		chunk = items[start:start + 25]
+		ratelimit.acquire(ratelimit.BULK)
+		try:
+			reddit.inbox.mark_read([message for message, entryId in chunk])
+			marked.extend(chunk)
+		except Exception:
+			log.warning("Couldn't mark {} messages read".format(len(chunk)))
+			log.warning(traceback.format_exc())
+	return marked
+
+
+@contextmanager
+def deferMarkRead(onFlush=None):
+	global readBatch
+	with readLock:
+		readBatch = []
+	try:
+		yield
+	finally:
+		with readLock:
+			items = readBatch
+			readBatch = None
+		marked = markReadBatch(items)
+		if onFlush is not None:
+			onFlush(items, marked)
 
 
 def replyMessage(message, body):
+	ratelimit.acquire(ratelimit.REPLY)
 	try:
 		return message.reply(body)
 	except Exception as err:
@@ -111,11 +217,32 @@ def replyMessage(message, body):
 		return None
 
 
-def getRecentSentMessage():
-	return reddit.inbox.sent(limit=1).next()
+def getSentMessages(recipients, subject, priority=ratelimit.MESSAGE):
+	if not len(recipients):
+		return {}
+	ratelimit.acquire(priority)
+	pending = [recipient.lower() for recipient in recipients]
+	found = {}
+	try:
+		for sentMessage in reddit.inbox.sent(limit=len(pending) + globals.SENT_MESSAGE_LOOKBACK):
+			dest = str(sentMessage.dest).lower()
+			if dest in pending and dest not in found and sentMessage.subject == subject:
+				found[dest] = sentMessage
+				if len(found) == len(pending):
+					break
+	except Exception:
+		log.warning("Couldn't load sent messages")
+		log.warning(traceback.format_exc())
+
+	if len(found) < len(pending):
+		log.warning("Couldn't find sent messages for {}".format(
+			', '.join([recipient for recipient in pending if recipient not in found])))
+	return found
 
 
 def getThingFromFullname(fullname):
+	if fullname in thingCache:
+		return thingCache[fullname]
 	if fullname.startswith("t1"):
 		return getComment(fullname[3:])
 	elif fullname.startswith("t4"):
@@ -123,3 +250,43 @@ def getThingFromFullname(fullname):
 	else:
 		log.debug("Not a valid fullname: {}".format(fullname))
 		return None
+
+
+def getCommentsFromFullnames(fullnames):
+	results = {}
+	for start in range(0, len(fullnames), 100):
+		ratelimit.acquire(ratelimit.BULK)
+		try:
+			for thing in reddit.info(fullnames=fullnames[start:start + 100]):
+				results[thing.fullname] = thing
+		except Exception:
+			log.warning("Couldn't load comments")
+			log.warning(traceback.format_exc())
+	return results
+
+
+def prefetchThings(fullnames):
+	missing = [fullname for fullname in dict.fromkeys(fullnames) if fullname is not None and fullname.startswith("t1") and fullname not in thingCache]
+	if not len(missing):
+		return
+	results = getCommentsFromFullnames(missing)
+	log.debug("Prefetched {} of {} things".format(len(results), len(missing)))
+	thingCache.update(results)
+
+
+@contextmanager
+def thingBatch(fullnames=None):
+	global batchDepth
+	batchDepth += 1
+	try:
+		if fullnames is not None:
+			prefetchThings(fullnames)
+		yield
+	finally:
+		batchDepth -= 1
+		if batchDepth == 0:
+			thingCache.clear()
+
+
+sendSingleMessageAsync = aio.wrap(sendSingleMessage)
+getWikiPageAsync = aio.wrap(getWikiPage)
@@ -0,0 +1,245 @@
+import time
+import threading
+import traceback
+import logging.handlers
+from datetime import datetime
+
+import globals
+import utils
+import index
+import state
+import reddit
+import journal
+import database
+import outbound
+import slate
+import ratelimit
+import edits
+import dispatcher
+from classes import Action
+
+log = logging.getLogger("bot")
+
+wakeEvent = threading.Event()
+timerThread = None
+
+
+def start():
+	global timerThread
+	timerThread = threading.Thread(target=run, name="scheduler", daemon=True)
+	timerThread.start()
+	log.info("Started playclock scheduler")
+
+
+def wake():
+	wakeEvent.set()
+
+
+def getWaitSeconds():
+	times = []
+	for dueTime in [index.getNextPlayclock(), index.getNextPlayclockWarning(), slate.getNextStart(), edits.getNextDue()]:
+		if dueTime is not None:
+			times.append(dueTime)
+	if not len(times):
+		return globals.SCHEDULER_MAX_WAIT
+
+	seconds = (min(times) - datetime.utcnow()).total_seconds()
+	return min(max(seconds, globals.SCHEDULER_MIN_WAIT), globals.SCHEDULER_MAX_WAIT)
+
+
+def isDue(dueTime, now):
+	return dueTime is not None and dueTime < now
+
+
+def run():
+	while True:
+		wakeEvent.wait(getWaitSeconds())
+		wakeEvent.clear()
+
+		try:
+			now = datetime.utcnow()
+			if isDue(index.getNextPlayclock(), now) or isDue(index.getNextPlayclockWarning(), now):
+				with dispatcher.exclusive():
+					processPastPlayclock()
+					processPlayclockWarnings()
+			edits.processDueEdits()
+			slate.processDueGames()
+		except Exception as err:
+			log.warning("Hit an error in scheduler")
+			log.warning(traceback.format_exc())
+			time.sleep(globals.SCHEDULER_MAX_WAIT)
+
+
+def setGameErrored(game, entryId=None):
+	log.debug("Setting game {} as errored".format(game.thread))
+	if entryId is not None:
+		journal.resume(entryId)
+	index.setGameErrored(game)
+	utils.saveGameObject(game)
+	journal.commit()
+	try:
+		reddit.sendMessage(globals.OWNER, "NCFAA game errored", utils.renderGameStatusMessage(game), ratelimit.BULK)
+	except Exception as err:
+		log.warning("Error sending error message")
+		log.warning(traceback.format_exc())
+
+
+def processPastPlayclock():
+	startTime = time.perf_counter()
+	penalties = []
+	for game in index.getGamesPastPlayclock():
+		utils.setLogGameID(game.thread, game)
+		entryId = "penalty_{}".format(game.thread)
+		try:
+			journal.begin(entryId, game)
+			penalties.append((game, computePlayclockPenalty(game), journal.detach()))
+		except Exception as err:
+			log.warning("Error applying playclock penalty")
+			log.warning(traceback.format_exc())
+			setGameErrored(game, entryId)
+	utils.clearLogGameID()
+
+	if not len(penalties):
+		return
+
+	with database.transaction():
+		for game, penalty, entryId in penalties:
+			journal.resume(entryId)
+			journal.record('intent', penalty)
+			utils.setGamePlayed(game)
+			utils.saveGameObject(game)
+			journal.detach()
+
+	futures = []
+	for game, penalty, entryId in penalties:
+		futures.append(outbound.submit(dispatchPenalty, game, penalty, entryId))
+	for (game, penalty, entryId), future in zip(penalties, futures):
+		if future.exception() is not None:
+			setGameErrored(game, entryId)
+
+	log.info("Processed {} playclock penalties in {:.1f} seconds".format(len(penalties), time.perf_counter() - startTime))
+
+
+def computePlayclockPenalty(game):
+	log.debug("Game past playclock: {}".format(game.thread))
+	utils.cycleStatus(game, None)
+	game.status.state(game.status.waitingOn).playclockPenalties += 1
+	penaltyMessage = "{} has not sent their number in over 24 hours, playclock penalty. This is their {} penalty.".format(
+		utils.getCoachString(game, game.status.waitingOn), utils.getNthWord(game.status.state(game.status.waitingOn).playclockPenalties))
+	sendDefensive = False
+	postGame = False
+	if game.status.state(game.status.waitingOn).playclockPenalties >= 3:
+		log.debug("3 penalties, game over")
+		utils.setGameEnded(game, game.team(game.status.waitingOn.negate()).name)
+		resultMessage = "They forfeit the game. {} has won!".format(utils.flair(game.team(game.status.waitingOn.negate())))
+		postGame = True
+
+	elif game.status.waitingOn == game.status.possession:
+		log.debug("Waiting on offense, turnover")
+		if utils.isGameOvertime(game):
+			resultMessage = state.overtimeTurnover(game)
+			sendDefensive = game.status.waitingAction != Action.END
+		else:
+			state.turnover(game)
+			game.status.waitingOn = game.status.possession.negate()
+			sendDefensive = True
+			resultMessage = "Turnover, {} has the ball.".format(utils.flair(game.team(game.status.waitingOn)))
+
+	else:
+		log.debug("Waiting on defense, touchdown")
+		if utils.isGameOvertime(game):
+			state.forceTouchdown(game, game.status.possession)
+			resultMessage = state.overtimeTurnover(game)
+			sendDefensive = game.status.waitingAction != Action.END
+		else:
+			state.forceTouchdown(game, game.status.possession)
+			state.setStateTouchback(game, game.status.possession.negate())
+			game.status.waitingOn.reverse()
+			sendDefensive = True
+			resultMessage = "Automatic 7 point touchdown, {} has the ball.".format(utils.flair(game.team(game.status.waitingOn)))
+
+	return {
+		'comment': "{}\n\n{}".format(penaltyMessage, resultMessage),
+		'defensive': sendDefensive,
+		'postGame': postGame
+	}
+
+
+def dispatchPenalty(game, penalty, entryId, completed=None):
+	if completed is None:
+		completed = {}
+	journal.resume(entryId)
+	utils.setLogGameID(game.thread, game)
+
+	comment = penalty['comment']
+	if penalty['postGame']:
+		if 'post' in completed:
+			postResult = completed['post']
+		else:
+			postResult = utils.postGameEnd(game)
+			journal.record('post', postResult)
+		comment = "{}\n\n{}".format(comment, postResult)
+
+	if 'comment' not in completed:
+		utils.sendGameComment(game, comment, None, False)
+	if penalty['defensive']:
+		if 'message' in completed:
+			game.status.waitingId = completed['message']
+		else:
+			utils.sendDefensiveNumberMessage(game)
+	utils.updateGameThread(game)
+	journal.commit()
+
+
+def processPlayclockWarnings():
+	games = index.getGamesPastPlayclockWarning()
+	if not len(games):
+		return
+
+	coachGames = {}
+	for game in games:
+		for coach in game.team(game.status.waitingOn).coaches:
+			coachGames.setdefault(coach.lower(), []).append(game)
+
+	for coach, warningGames in coachGames.items():
+		try:
+			sendWarningDigest(coach, warningGames)
+		except Exception as err:
+			log.warning("Error sending 12 hour warning to {}".format(coach))
+			log.warning(traceback.format_exc())
+
+	with database.transaction():
+		for game in games:
+			game.playclockWarning = True
+			utils.saveGameObject(game)
+	log.debug("Sent 12 hour warnings for {} games to {} coaches".format(len(games), len(coachGames)))
+
+
+def getWarningLine(game):
+	return "[{} vs {}]({}), waiting on a reply to this {}".format(
+		game.away.name,
+		game.home.name,
+		utils.getLinkToThread(game.thread),
+		utils.getLinkFromGameThing(game.thread, utils.getPrimaryWaitingId(game.status.waitingId)))
+
+
+def sendWarningDigest(coach, games):
+	if len(games) == 1:
+		game = games[0]
+		subject = "{} vs {} 12 hour warning".format(game.away.name, game.home.name)
+		warningText = "This is a warning that your [game]({}) is waiting on a reply from you to " \
+						"this {}. You have 12 hours until a delay of game penalty."\
+						.format(utils.getLinkToThread(game.thread),
+								utils.getLinkFromGameThing(game.thread, utils.getPrimaryWaitingId(game.status.waitingId)))
+	else:
+		subject = "12 hour warning for {} games".format(len(games))
+		bldr = ["This is a warning that these games are waiting on a reply from you. "
+				"You have 12 hours until a delay of game penalty in each.\n\n"]
+		for game in games:
+			bldr.append("* ")
+			bldr.append(getWarningLine(game))
+			bldr.append("\n")
+		warningText = ''.join(bldr)
+
+	if reddit.sendSingleMessage(coach, subject, warningText, ratelimit.BULK):
+		log.debug("12 hour warning sent to /u/{} for games {}".format(coach, ','.join([game.thread for game in games])))
@@ -1,27 +1,40 @@
-import os
-
 import utils
+import archive
+import migrate
+import slate
 import globals
 import classes
 
 
-def addWinnerFieldToGames():
-	folder = globals.SAVE_FOLDER_NAME
-	for fileName in os.listdir(folder):
-		if not os.path.isfile(os.path.join(folder, fileName)):
-			continue
-		game = utils.loadGameObject(fileName)
-		game.status.winner = None
-		for status in game.previousStatus:
-			status.winner = None
-		utils.saveGameObject(game)
-
-
-def archiveOutstandingFinishedGames():
-	folder = globals.SAVE_FOLDER_NAME
-	for fileName in os.listdir(folder):
-		if not os.path.isfile(os.path.join(folder, fileName)):
-			continue
-		game = utils.loadGameObject(fileName)
-		if game.status.quarterType == classes.QuarterType.END:
-			utils.archiveGameFile(game.thread)
+def addWinnerField(game):
+	game.status.winner = None
+	for status in game.previousStatus:
+		status.winner = None
+	return True
+
+
+def addWinnerFieldToGames(dryRun=False):
+	return migrate.runMigration("addWinnerField", addWinnerField, dryRun=dryRun)
+
+
+def isGameFinished(game):
+	return game.status.quarterType == classes.QuarterType.END
+
+
+def archiveFinishedGame(fileName, result):
+	utils.archiveGameFile(fileName)
+
+
+def archiveOutstandingFinishedGames(dryRun=False):
+	return migrate.runMigration("archiveFinishedGames", isGameFinished, save=False, dryRun=dryRun,
+								onResult=archiveFinishedGame)
+
+
+def compactArchive():
+	archive.indexLooseFiles()
+	while len(archive.getStagedThreads()) >= globals.ARCHIVE_SEGMENT_SIZE:
+		archive.compactSegment()
+
+
+def queueScheduleFile(fileName):
+	return slate.loadScheduleFromFile(fileName)
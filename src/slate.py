@@ -0,0 +1,192 @@
+import os
+import pickle
+import threading
+import logging.handlers
+import traceback
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+
+import globals
+import utils
+import wiki
+import reddit
+import outbound
+
+log = logging.getLogger("bot")
+
+pending = None
+lock = threading.RLock()
+
+
+def loadPending():
+	global pending
+	with lock:
+		if pending is not None:
+			return pending
+		try:
+			file = open(globals.SLATE_FILE_NAME, 'rb')
+		except FileNotFoundError:
+			pending = []
+			return pending
+		pending = pickle.load(file)
+		file.close()
+		return pending
+
+
+def savePending():
+	with lock:
+		tempName = globals.SLATE_FILE_NAME + ".tmp"
+		file = open(tempName, 'wb')
+		pickle.dump(pending, file)
+		file.close()
+		os.replace(tempName, globals.SLATE_FILE_NAME)
+
+
+def parseStart(startString):
+	try:
+		localized = globals.EASTERN.localize(datetime.strptime(startString.strip(), "%Y-%m-%d %H:%M"))
+	except ValueError:
+		return None
+	return localized.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def emptyToNone(value):
+	value = value.strip()
+	if value == "":
+		return None
+	return utils.escapeMarkdown(value)
+
+
+def parseSchedule(scheduleText):
+	entries = []
+	for line in scheduleText.splitlines():
+		if line.strip() == "" or line.startswith("#"):
+			continue
+		items = line.split('|')
+		if len(items) < 3:
+			log.warning("Could not parse schedule line: {}".format(line))
+			continue
+
+		start = parseStart(items[2])
+		if start is None:
+			log.warning("Invalid start time in schedule line: {}".format(line))
+			continue
+
+		home = items[0].strip().lower()
+		away = items[1].strip().lower()
+		if wiki.getTeamByTag(home) is None or wiki.getTeamByTag(away) is None:
+			log.warning("Invalid team in schedule line: {}".format(line))
+			continue
+
+		items.extend([""] * (8 - len(items)))
+		entries.append({
+			'home': home,
+			'away': away,
+			'start': start,
+			'startTime': emptyToNone(items[3]),
+			'location': emptyToNone(items[4]),
+			'station': emptyToNone(items[5]),
+			'homeRecord': emptyToNone(items[6]),
+			'awayRecord': emptyToNone(items[7])
+		})
+	return entries
+
+
+def queueGames(entries):
+	with lock:
+		loadPending()
+		existing = set((entry['home'], entry['away'], entry['start']) for entry in pending)
+		count = 0
+		for entry in entries:
+			if (entry['home'], entry['away'], entry['start']) in existing:
+				continue
+			pending.append(entry)
+			count += 1
+		pending.sort(key=lambda entry: entry['start'])
+		savePending()
+	log.info("Queued {} scheduled games, {} pending".format(count, len(pending)))
+	return count
+
+
+def loadScheduleFromWiki(pageName="schedule"):
+	return queueGames(parseSchedule(reddit.getWikiPage(globals.CONFIG_SUBREDDIT, pageName)))
+
+
+def loadScheduleFromFile(fileName):
+	file = open(fileName, 'r')
+	scheduleText = file.read()
+	file.close()
+	return queueGames(parseSchedule(scheduleText))
+
+
+def getNextStart():
+	with lock:
+		loadPending()
+		if not len(pending):
+			return None
+		return pending[0]['start']
+
+
+def removeEntry(entry):
+	with lock:
+		if entry in pending:
+			pending.remove(entry)
+			savePending()
+
+
+def retryEntry(entry):
+	with lock:
+		if entry not in pending:
+			return
+		entry['attempts'] = entry.get('attempts', 0) + 1
+		if entry['attempts'] >= globals.SLATE_RETRIES:
+			log.warning("Giving up on scheduled game {} vs {} after {} attempts".format(entry['home'], entry['away'], entry['attempts']))
+			pending.remove(entry)
+		else:
+			entry['start'] = datetime.utcnow() + timedelta(seconds=globals.SLATE_RETRY_DELAY)
+			pending.sort(key=lambda entry: entry['start'])
+		savePending()
+
+
+def startScheduledGame(game):
+	utils.setLogGameID(game.thread, game)
+	utils.postCoinToss(game)
+
+
+def processDueGames():
+	with lock:
+		loadPending()
+		now = datetime.utcnow()
+		due = [entry for entry in pending if entry['start'] <= now]
+	if not len(due):
+		return
+
+	log.info("Starting {} scheduled games".format(len(due)))
+	games = []
+	futures = []
+	for entry in due:
+		try:
+			game, error = utils.createGame(entry['home'], entry['away'], entry['startTime'], entry['location'],
+											entry['station'], entry['homeRecord'], entry['awayRecord'])
+			if error is not None:
+				log.warning("Couldn't start scheduled game {} vs {}: {}".format(entry['home'], entry['away'], error))
+				removeEntry(entry)
+				continue
+			utils.submitGameThread(game, entry['homeRecord'], entry['awayRecord'])
+		except Exception as err:
+			log.warning("Couldn't submit scheduled game {} vs {}".format(entry['home'], entry['away']))
+			log.warning(traceback.format_exc())
+			retryEntry(entry)
+			continue
+
+		removeEntry(entry)
+		games.append(game)
+		futures.append(outbound.submit(startScheduledGame, game))
+
+	for game, future in zip(games, futures):
+		if future.exception() is not None:
+			log.warning("Couldn't post coin toss for scheduled game {}".format(game.thread))
+	utils.clearLogGameID()
+	log.info("Started {} of {} scheduled games".format(len(games), len(due)))
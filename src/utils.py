@@ -14,10 +14,16 @@ from datetime import datetime
 from datetime import timedelta
 
 import globals
+import archive
 import wiki
 import reddit
 import classes
 import index
+import journal
+import database
+import edits
+import context
+import dispatcher
 import discord_msg
 from classes import HomeAway
 from classes import Action
@@ -34,12 +40,24 @@ def getLinkToThread(threadID):
 
 
 def startGame(homeTeam, awayTeam, startTime=None, location=None, station=None, homeRecord=None, awayRecord=None):
+	game, error = createGame(homeTeam, awayTeam, startTime, location, station, homeRecord, awayRecord)
+	if error is not None:
+		return error
+
+	submitGameThread(game, homeRecord, awayRecord)
+	postCoinToss(game)
+
+	log.debug("Returning game started message")
+	return "Game started. Find it [here]({}).".format(getLinkToThread(game.thread))
+
+
+def createGame(homeTeam, awayTeam, startTime=None, location=None, station=None, homeRecord=None, awayRecord=None):
 	log.debug("Creating new game between {} and {}".format(homeTeam, awayTeam))
 
 	result = verifyTeams([homeTeam, awayTeam])
 	if result is not None:
 		log.debug("Coaches not verified, {}".format(result))
-		return "Something went wrong, someone is no longer an acceptable coach. Please try to start the game again"
+		return None, "Something went wrong, someone is no longer an acceptable coach. Please try to start the game again"
 
 	homeTeam = wiki.getTeamByTag(homeTeam.lower())
 	awayTeam = wiki.getTeamByTag(awayTeam.lower())
@@ -56,6 +74,10 @@ def startGame(homeTeam, awayTeam, startTime=None, location=None, station=None, h
 	if awayRecord is not None:
 		awayTeam.record = awayRecord
 
+	return game, None
+
+
+def submitGameThread(game, homeRecord=None, awayRecord=None):
 	gameThread = renderGame(game)
 	gameTitle = "[GAME THREAD] {}{} @ {}{}".format(
 		"{} ".format(unescapeMarkdown(awayRecord)) if awayRecord is not None else "",
@@ -63,17 +85,20 @@ def startGame(homeTeam, awayTeam, startTime=None, location=None, station=None, h
 		"{} ".format(unescapeMarkdown(homeRecord)) if homeRecord is not None else "",
 		game.home.name)
 
-	threadID = str(reddit.submitSelfPost(globals.SUBREDDIT, gameTitle, gameThread))
+	threadID = str(reddit.submitSelfPostRetry(globals.SUBREDDIT, gameTitle, gameThread))
 	game.thread = threadID
 	log.debug("Game thread created: {}".format(threadID))
 
-	index.addNewGame(game)
+	with dispatcher.exclusive():
+		index.addNewGame(game)
 
 	for user in game.home.coaches:
 		log.debug("Coach added to home: {}".format(user))
 	for user in game.away.coaches:
 		log.debug("Coach added to away: {}".format(user))
 
+
+def postCoinToss(game):
 	log.debug("Game started, posting coin toss comment")
 	message = "{}\n\n" \
 			  "The game has started! {}, you're home. {}, you're away, call **heads** or **tails** in the air." \
@@ -82,9 +107,6 @@ def startGame(homeTeam, awayTeam, startTime=None, location=None, station=None, h
 	log.debug("Comment posted, now waiting on: {}".format(game.status.waitingId))
 	updateGameThread(game)
 
-	log.debug("Returning game started message")
-	return "Game started. Find it [here]({}).".format(getLinkToThread(threadID))
-
 
 PUBLIC_ENUMS = {
 	'Action': Action
@@ -127,6 +149,19 @@ def extractTableFromMessage(message):
 		return None
 
 
+def recordThing(thing, table):
+	if thing is None or table is None or 'thread' not in table:
+		return
+	database.addThing(thing.fullname, table['thread'], json.dumps(table, cls=EnumEncoder))
+
+
+def getThingTable(fullname):
+	data = database.getThing(fullname)
+	if data is None:
+		return None
+	return json.loads(data, object_hook=as_enum)
+
+
 def getActionTable(game, action):
 	return {'action': action, 'thread': game.thread}
 
@@ -145,7 +180,7 @@ def verifyTeams(teamTags):
 			log.debug("{} is not a valid team".format(homeAway))
 			return "The {} team is not valid".format(homeAway)
 
-		existingGame = index.getGameFromTeamTag(tag)
+		existingGame = index.getHeaderFromTeamTag(tag)
 		if existingGame is not None:
 			log.debug("{} is already in a game".format(tag))
 			return "The team {} is already in a [game]({})".format(tag, getLinkToThread(existingGame.thread))
@@ -437,33 +472,54 @@ def playNumber():
 
 
 def saveGameObject(game):
-	file = open("{}/{}".format(globals.SAVE_FOLDER_NAME, game.thread), 'wb')
-	pickle.dump(game, file)
-	file.close()
+	with index.lock:
+		game.version = getattr(game, 'version', 0) + 1
+		gamePath = "{}/{}".format(globals.SAVE_FOLDER_NAME, game.thread)
+		if game.status.waitingAction != Action.END or not saveEndedGame(game):
+			file = open(gamePath + ".tmp", 'wb')
+			pickle.dump(game, file)
+			file.close()
+			os.replace(gamePath + ".tmp", gamePath)
+			if game.status.waitingAction != Action.END:
+				archive.removeGame(game.thread)
+			index.updateGameHeader(game)
+	journal.record('save')
+
+
+def saveEndedGame(game):
+	log.debug("Archiving ended game: {}".format(game.thread))
+	try:
+		archive.saveGame(game)
+	except Exception as err:
+		log.warning("Can't archive game: {}".format(game.thread))
+		log.warning(traceback.format_exc())
+		return False
+	gamePath = "{}/{}".format(globals.SAVE_FOLDER_NAME, game.thread)
+	if os.path.exists(gamePath):
+		os.remove(gamePath)
+	return True
 
 
 def loadGameObject(threadID):
 	try:
 		file = open("{}/{}".format(globals.SAVE_FOLDER_NAME, threadID), 'rb')
 	except FileNotFoundError as err:
-		log.warning("Game file doesn't exist: {}".format(threadID))
-		return None
+		game = archive.getGame(threadID)
+		if game is None:
+			log.warning("Game file doesn't exist: {}".format(threadID))
+		return game
 	game = pickle.load(file)
 	file.close()
 	return game
 
 
-def gameSortValue(game):
-	return game.status.quarter * 1000 + game.status.clock
-
-
 def updateGameThread(game):
 	if game.thread is None:
 		log.error("No thread ID in game when trying to update")
 	game.dirty = False
 	saveGameObject(game)
-	threadText = renderGame(game)
-	reddit.editThread(game.thread, threadText)
+	edits.queueEdit(game)
+	journal.record('thread')
 
 
 def coachHomeAway(game, coach):
@@ -476,14 +532,20 @@ def coachHomeAway(game, coach):
 
 
 def sendGameMessage(isHome, game, message, dataTable):
-	reddit.sendMessage(game.team(isHome).coaches,
+	results = reddit.sendMessage(game.team(isHome).coaches,
 					   "{} vs {}".format(game.home.name, game.away.name),
 					   embedTableInMessage(message, dataTable))
-	return reddit.getRecentSentMessage().id
+	for result in results:
+		recordThing(result, dataTable)
+	if not len(results):
+		return None
+	return results[-1].id
 
 
 def sendGameComment(game, message, dataTable=None, saveWaiting=True):
 	commentResult = reddit.replySubmission(game.thread, embedTableInMessage(message, dataTable))
+	journal.record('comment', commentResult.fullname if commentResult is not None else None)
+	recordThing(commentResult, dataTable)
 	if saveWaiting:
 		setWaitingId(game, commentResult.fullname)
 	log.debug("Game comment sent, now waiting on: {}".format(game.status.waitingId))
@@ -665,6 +727,7 @@ def sendDefensiveNumberMessage(game):
 	#						),
 	#						getActionTable(game, game.status.waitingAction)
 	#					))
+	actionTable = getActionTable(game, game.status.waitingAction)
 	results = reddit.sendMessage(recipients=game.team(defenseHomeAway).coaches,
 						subject="{} vs {}".format(game.away.name, game.home.name),
 						message=embedTableInMessage(
@@ -673,11 +736,13 @@ def sendDefensiveNumberMessage(game):
 								getCurrentPlayString(game),
 								renderDatetime(game.playclock)
 							),
-							getActionTable(game, game.status.waitingAction)
+							actionTable
 						))
 	resetWaitingId(game)
 	for message in results:
 		addWaitingId(game, message.fullname)
+		recordThing(message, actionTable)
+	journal.record('message', game.status.waitingId)
 	log.debug("Defensive number sent, now waiting on: {}".format(game.status.waitingId))
 
 
@@ -701,13 +766,13 @@ def extractPlayNumber(message):
 
 
 def setLogGameID(threadId, game):
-	globals.game = game
-	globals.logGameId = " {}:".format(threadId)
+	context.game.set(game)
+	context.logGameId.set(" {}:".format(threadId))
 
 
 def clearLogGameID():
-	globals.game = None
-	globals.logGameId = ""
+	context.game.set(None)
+	context.logGameId.set("")
 
 
 def findKeywordInMessage(keywords, message):
@@ -780,6 +845,36 @@ def isGameOvertime(game):
 	return game.status.quarterType in [QuarterType.OVERTIME_NORMAL, QuarterType.OVERTIME_TIME]
 
 
+def getRemainingClock(game):
+	if game.status.quarterType != QuarterType.NORMAL or game.status.quarter > 4:
+		return 0
+	return (4 - game.status.quarter) * globals.quarterLength + game.status.clock
+
+
+def updateForecast(game, now=None):
+	if now is None:
+		now = datetime.utcnow()
+	remaining = getRemainingClock(game)
+	forecastTime = getattr(game, 'forecastTime', None)
+	forecastClock = getattr(game, 'forecastClock', None)
+	if forecastTime is not None and forecastClock is not None:
+		clockUsed = forecastClock - remaining
+		if clockUsed <= 0:
+			return
+		rate = (now - forecastTime).total_seconds() / clockUsed
+		previous = getattr(game, 'secondsPerClock', None)
+		if previous is None:
+			game.secondsPerClock = rate
+		else:
+			game.secondsPerClock = previous + globals.FORECAST_SMOOTHING * (rate - previous)
+		game.projectedFinish = now + timedelta(seconds=remaining * game.secondsPerClock)
+		log.debug("Game {} playing at {:.1f} seconds per clock second, projected to finish {}".format(
+			game.thread, game.secondsPerClock, game.projectedFinish))
+
+	game.forecastTime = now
+	game.forecastClock = remaining
+
+
 def renderDatetime(dtTm, includeLink=True):
 	localized = pytz.utc.localize(dtTm).astimezone(globals.EASTERN)
 	timeString = localized.strftime("%m/%d %I:%M %p EST")
@@ -818,7 +913,7 @@ def newDebugGameObject():
 def archiveGameFile(threadID):
 	log.debug("Archiving game: {}".format(threadID))
 	try:
-		os.rename("{}/{}".format(globals.SAVE_FOLDER_NAME, threadID), "{}/{}".format(globals.ARCHIVE_FOLDER_NAME, threadID))
+		archive.archiveGame(threadID)
 	except Exception as err:
 		log.warning("Can't archive game file: {}".format(threadID))
 		log.warning(traceback.format_exc())
@@ -827,6 +922,11 @@ def archiveGameFile(threadID):
 
 
 def endGame(game, winner, postThread=True):
+	setGameEnded(game, winner)
+	return postGameEnd(game, postThread)
+
+
+def setGameEnded(game, winner):
 	game.status.quarterType = QuarterType.END
 	game.status.waitingAction = Action.END
 	game.status.winner = winner
@@ -834,6 +934,8 @@ def endGame(game, winner, postThread=True):
 		game.status.down = 4
 	index.endGame(game)
 
+
+def postGameEnd(game, postThread=True):
 	discord_msg.discordFinal(game)
 
 	if postThread:
@@ -855,6 +957,7 @@ def endGame(game, winner, postThread=True):
 def pauseGame(game, hours):
 	game.playclock = datetime.utcnow() + timedelta(hours=hours)
 	game.deadline = game.deadline + timedelta(hours=hours)
+	index.rescheduleGame(game)
 
 
 def renderGameStatusMessage(game):
@@ -916,6 +1019,7 @@ def renderGameStatusMessage(game):
 def setGamePlayed(game):
 	game.playclock = datetime.utcnow() + timedelta(hours=24)
 	game.playclockWarning = False
+	index.rescheduleGame(game)
 
 
 driveEnders = [Result.TURNOVER, Result.TOUCHDOWN, Result.TURNOVER_TOUCHDOWN, Result.FIELD_GOAL, Result.PUNT]
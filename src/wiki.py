@@ -5,6 +5,7 @@ from datetime import datetime
 from datetime import timedelta
 
 import reddit
+import aio
 import globals
 import classes
 from classes import OffenseType
@@ -25,17 +26,23 @@ intro = "Welcome to /r/FakeCollegeFootball!"
 lastTime = None
 
 
+def pagesStale():
+	return lastTime is None or lastTime + timedelta(minutes=15) < datetime.utcnow()
+
+
 def loadPages(force=False):
 	global lastTime
-	if force or lastTime is None or lastTime + timedelta(minutes=15) < datetime.utcnow():
+	if force or pagesStale():
 		startTime = time.perf_counter()
 		log.debug("Loading pages")
 		lastTime = datetime.utcnow()
-		loadTeams()
-		loadPlays()
-		loadTimes()
-		loadAdmins()
-		loadIntro()
+		teamsPage, playsPage, timesPage, adminsPage, introPage = aio.gather(
+			*[reddit.getWikiPageAsync(globals.CONFIG_SUBREDDIT, pageName) for pageName in ["teams", "new_plays", "new_times", "admins", "intro"]])
+		loadTeams(teamsPage)
+		loadPlays(playsPage)
+		loadTimes(timesPage)
+		loadAdmins(adminsPage)
+		loadIntro(introPage)
 		log.debug("Done loading pages in: %d", int(time.perf_counter() - startTime))
 
 
@@ -123,10 +130,9 @@ def parseResult(resultString):
 		return None
 
 
-def loadTeams():
+def loadTeams(teamsPage):
 	global teams
 	teams = {}
-	teamsPage = reddit.getWikiPage(globals.CONFIG_SUBREDDIT, "teams")
 
 	requirements = {
 		'tag': "[a-z]+",
@@ -219,10 +225,9 @@ def parsePlayPart(playPart):
 	return range, play
 
 
-def loadPlays():
+def loadPlays(playsPage):
 	global plays
 	plays = {}
-	playsPage = reddit.getWikiPage(globals.CONFIG_SUBREDDIT, "new_plays")
 
 	for playLine in playsPage.splitlines():
 		items = playLine.split('|')
@@ -271,10 +276,9 @@ def loadPlays():
 			plays[playType][items[1]] = playParts
 
 
-def loadTimes():
+def loadTimes(timesPage):
 	global times
 	times = {}
-	timesPage = reddit.getWikiPage(globals.CONFIG_SUBREDDIT, "new_times")
 
 	for timeLine in timesPage.splitlines():
 		items = timeLine.split('|')
@@ -338,8 +342,7 @@ def getTimeByPlay(play):
 		return None
 
 
-def loadAdmins():
-	adminsPage = reddit.getWikiPage(globals.CONFIG_SUBREDDIT, "admins")
+def loadAdmins(adminsPage):
 
 	for line in adminsPage.splitlines():
 		admins.add(line.lower())
@@ -347,6 +350,6 @@ def loadAdmins():
 	admins.add(globals.OWNER)
 
 
-def loadIntro():
+def loadIntro(introPage):
 	global intro
-	intro = reddit.getWikiPage(globals.CONFIG_SUBREDDIT, "intro")
+	intro = introPage